@@ -1,8 +1,13 @@
 from pprint import pprint
 import uvicorn
+import os
 import json
+import time
+import asyncio
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, status
+from typing import Annotated
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Security, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -10,9 +15,24 @@ from beanie import init_beanie, PydanticObjectId
 from beanie.operators import And, In, Push
 
 # Import routers from src package
-from src import articles, messages, users, posts, councilor, auth
-
-from utils.websocket import WebsocketConnectionManager
+from src import articles, messages, users, posts, councilor, auth, groups, conversations
+
+from utils.websocket import Delivery, WebsocketConnectionManager, encode
+from utils.broker import broker
+from utils.groups import GROUPS, group_membership
+from utils.feeds import feed_cache
+from utils.councilor_directory import councilor_directory
+from utils.message_journal import message_journal
+from utils.index_report import report_unindexed_queries
+from utils.embedding_cache import CachedEmbeddings
+from utils.knowledge_base import KnowledgeBase
+from utils.concurrency import FairLimiter
+from utils.semantic_cache import SemanticCache
+from utils.bot_session import BotSession
+from utils.batch_retriever import BatchRetriever
+from utils.responses import JSONResponse
+from utils.metrics import CONTENT_TYPE, RequestMetricsMiddleware, mongo_command_listener, registry
+from utils.rag_metrics import RAG_STAGE_DURATION, generation_metrics
 
 # Import document models from schemas package
 from schemas import articles as article_schemas
@@ -20,24 +40,35 @@ from schemas import messages as message_schemas
 from schemas import users as user_schemas
 from schemas import posts as post_schemas
 from schemas import councilor as councilor_schemas
+from schemas import groups as group_schemas
+from schemas import conversations as conversation_schemas
 
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
+
+from security.helpers import get_current_active_user
+from security.principal_cache import principal_cache
 
 from langchain_ollama import OllamaEmbeddings, ChatOllama
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.runnables import RunnablePassthrough, Runnable
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.vectorstores import FAISS
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains.retrieval import create_retrieval_chain
 
-embeddings = OllamaEmbeddings(
-    model="gemma2:2b",
+EMBEDDING_MODEL = "gemma2:2b"
+
+#* Questions are embedded directly, only knowledge chunks go through the persistent cache
+query_embeddings = OllamaEmbeddings(
+    model=EMBEDDING_MODEL,
+)
+
+embeddings = CachedEmbeddings(
+    query_embeddings,
+    model_name=EMBEDDING_MODEL,
 )
 
 model = ChatOllama(
     model="gemma2:2b",
+    callbacks=[generation_metrics] if registry.enabled else None,
 )
 
 html = """
@@ -76,24 +107,38 @@ html = """
 
 chat_bot = {}
 
+#* Bounds concurrent LLM generations, slots are shared fairly between bot connections
+bot_limiter = FairLimiter(int(os.getenv("BOT_MAX_CONCURRENCY", 4)))
 
-file_path = "./porn-addict.pdf"
-loader = PyPDFLoader(file_path, extract_images=True)
+#* Answers near-duplicate questions without calling the LLM
+semantic_cache = SemanticCache(query_embeddings)
 
-data = loader.load()
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+
+knowledge_base = KnowledgeBase(
+    embeddings,
+    embedding_model=EMBEDDING_MODEL,
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+)
 
 
 def init_bot():
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-    splits = text_splitter.split_documents(data)
+    #* Reuse the persisted index and only index documents that changed since it was saved,
+    #* workers starting together wait for the first one to build it and then load it
+    knowledge_base.load()
+    knowledge_base.sync()
 
-    print("Done splitting")
+    print(f"Done creating vector store, embedding cache: {embeddings.stats()}")
 
-    vector_store = FAISS.from_documents(documents=splits, embedding=embeddings)
+    return build_rag_chain(knowledge_base.serving_store)
 
-    print("Done creating vector store")
 
-    retriever = vector_store.as_retriever()
+def build_rag_chain(vector_store: FAISS) -> Runnable:
+    #* Batches the retrieval of concurrent questions into one embedding call and one index search
+    retriever = BatchRetriever(vector_store, query_embeddings).as_runnable()
 
     print("Done creating retriever")
 
@@ -108,49 +153,111 @@ def init_bot():
         "Use the following pieces of retrieved context to answer"
         "the question. If you don't know the answer, you can suggest the user to speak to one of Addiction Aider councillors."
         "\n\n"
+        "Summary of the earlier conversation: {summary}"
+        "\n\n"
         "{context}"
     )
 
     prompt = ChatPromptTemplate.from_messages(
         [
             ("system", system_prompt),
+            MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
         ]
     )
 
     qa_chain = create_stuff_documents_chain(model, prompt)
-    rag_chain = create_retrieval_chain(retriever, qa_chain)
+
+    #* Same shape as create_retrieval_chain, but retrieves with the session-aware query
+    rag_chain = RunnablePassthrough.assign(
+        context=(lambda x: x["retrieval_query"]) | retriever
+    ).assign(answer=qa_chain)
 
     print("Done creating chains")
     return rag_chain
 
 
+BOT_INDEX_CHANNEL = "bot:index"
+
+
+#* Keeps references to running reloads so they are not garbage collected
+index_reloads: set[asyncio.Task] = set()
+
+
+async def _reload_bot_index():
+    try:
+        await asyncio.to_thread(knowledge_base.load)
+    except Exception as e:
+        print(f"Failed to reload the knowledge index: {str(e)}")
+        return
+    chat_bot["rag_chain"] = build_rag_chain(knowledge_base.serving_store)
+    semantic_cache.invalidate()
+    print("Reloaded the knowledge index synced by another worker")
+
+
+async def reload_bot_index(origin: str):
+    '''Switches to the index another worker just synced and saved
+
+    Called by the broker listener, which handles one message at a time, so
+    the index is loaded in a background task to keep chat delivery and cache
+    invalidations flowing while it loads.
+    '''
+    if origin == broker.node_id:
+        return
+    task = asyncio.create_task(_reload_bot_index())
+    index_reloads.add(task)
+    task.add_done_callback(index_reloads.discard)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    client = AsyncIOMotorClient("mongodb://localhost:27017")  # * Connect to MongoDB
-
+    client = AsyncIOMotorClient(
+        "mongodb://localhost:27017",
+        event_listeners=[mongo_command_listener] if registry.enabled else [],
+    )  # * Connect to MongoDB
+
+    document_models = [
+        article_schemas.Articles,
+        message_schemas.Messages,
+        user_schemas.Users,
+        post_schemas.Posts,
+        councilor_schemas.Councilor,
+        group_schemas.GroupMembers,
+        conversation_schemas.Conversations,
+    ]
     await init_beanie(
         database=client["Aider"],
-        document_models=[
-            article_schemas.Articles,
-            message_schemas.Messages,
-            user_schemas.Users,
-            post_schemas.Posts,
-            councilor_schemas.Councilor,
-        ],
-    )  # * Initialize Beanie
+        document_models=document_models,
+    )  # * Initialize Beanie, creating the indexes declared in each model's Settings
+    await report_unindexed_queries(document_models)
+    mongo_command_listener.register_models(document_models)
+    await group_membership.load()
+    await message_journal.start()
+
+    await broker.start()
+    await connection_manager.start(GROUPS)
+    await group_membership.attach(broker)
+    await feed_cache.attach(broker)
+    await councilor_directory.attach(broker)
+    await councilor_directory.start()
+    await principal_cache.attach(broker)
     chat_bot["rag_chain"] = init_bot()
+    await broker.subscribe(BOT_INDEX_CHANNEL, reload_bot_index)
 
     yield
+    await message_journal.close()  # * Write out buffered messages before disconnecting
+    await councilor_directory.close()
+    await broker.close()
     client.close()
 
-connection_manager = WebsocketConnectionManager()
+connection_manager = WebsocketConnectionManager(broker)
 app = FastAPI(
     title="Addiction Aider API",
     description="API for Addiction Aider",
     version="0.1",
     lifespan=lifespan,
     debug=True,
+    default_response_class=JSONResponse,
 )
 
 app.add_middleware(
@@ -161,15 +268,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+#* Only installed when enabled, so disabled metrics cost nothing per request
+if registry.enabled:
+    app.add_middleware(RequestMetricsMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    if not registry.enabled:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Metrics are disabled"
+        )
+
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/api/v1/bot/", tags=["Bot"])
 async def get():
     return HTMLResponse(html)
 
 
+@app.post("/api/v1/bot/sync", tags=["Bot"])
+async def sync_knowledge_base(current_user: Annotated[user_schemas.Users, Security(get_current_active_user, scopes=["admin"])]):
+    #* Index changed documents in a worker thread; the old chain keeps serving until the swap
+    summary = await asyncio.to_thread(knowledge_base.sync)
+
+    if any(summary.values()):
+        chat_bot["rag_chain"] = build_rag_chain(knowledge_base.serving_store)
+        semantic_cache.invalidate()
+        #* Other workers load the saved index instead of syncing it again
+        await broker.publish(BOT_INDEX_CHANNEL, broker.node_id)
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "status": "success",
+            "data": summary
+        }
+    )
+
+
 @app.websocket("/api/v1/chat/ws")
 async def chat_to_councilor_or_group(websocket: WebSocket):
-    groups = ["explicit-quitters", "grass-quitters"]
     await websocket.accept()
+    user_id = None
 
     try:
         # Validate initial connection
@@ -185,9 +328,10 @@ async def chat_to_councilor_or_group(websocket: WebSocket):
 
         while True:
             data: dict = await websocket.receive_json()
+            connection_manager.received()
             
-            # Validate connection status
-            if user_id not in connection_manager.active_connections:
+            # Validate connection status, the connection may have been dropped or replaced
+            if connection_manager.active_connections.get(user_id) is not websocket:
                 await websocket.close()
                 break
 
@@ -195,41 +339,28 @@ async def chat_to_councilor_or_group(websocket: WebSocket):
             data["sender"] = user_id
             recipient = data.get("recipient")
 
-            if recipient in groups:
+            if recipient in GROUPS:
                 # Group message logic
-                past_conversations = await message_schemas.Messages.find_many(
-                    message_schemas.Messages.recipient == recipient
-                ).to_list()
-                
-                active_users = set(connection_manager.active_connections.keys())
-                past_participants = {conv.sender for conv in past_conversations}
-                recipients = active_users & past_participants
-
-                print(f"Sending to group {recipient}, recipients: {recipients}")
-                for user in recipients:
-                    await connection_manager.send_to_user(user, data)
-                    
-                # Save message to database
-                new_message = await message_schemas.Messages(
-                    sender=user_id,
-                    recipient=recipient,
-                    content=data.get("message")
-                ).insert()
-                
-                # Add message ID to group's chats list
-                group_in_db = await user_schemas.Users.find_one(
-                    In(user_schemas.Users.username, groups),
-                )
-                await group_in_db.update(Push({user_schemas.Users.chats: new_message.id}))
-                await group_in_db.save()
+                #* Posting to a group makes the sender a member
+                await group_membership.join(recipient, user_id)
+
+                print(f"Sending to group {recipient}, members: {group_membership.members_of(recipient)}")
+                await connection_manager.send_to_group(recipient, data)
             else:
                 # Individual message logic
                 target_user = recipient
                 print(f"Attempting to send to individual: {target_user}")
                 
-                if target_user in connection_manager.active_connections:
-                    print(f"Sending to {target_user}: {data}")
-                    await connection_manager.send_to_user(target_user, data)
+                #* Delivered locally or through the broker to the process the user is connected to
+                delivery = await connection_manager.send_to_user(target_user, data)
+                if delivery is Delivery.SENT:
+                    print(f"Sent to {target_user}: {data}")
+                elif delivery is Delivery.DROPPED:
+                    print(f"Dropped message to slow consumer {target_user}")
+                    await connection_manager.send_to_user(user_id, {
+                        "status": "error",
+                        "message": f"Recipient {target_user} is not keeping up, the message was not delivered live"
+                    })
                 else:
                     print(f"Target user {target_user} not connected")
                     # Optionally notify sender about failed delivery
@@ -237,24 +368,29 @@ async def chat_to_councilor_or_group(websocket: WebSocket):
                         "status": "error",
                         "message": f"Recipient {target_user} is not connected"
                     })
-                    
-                # Save message to database
-                new_message = await message_schemas.Messages(
+
+            # Save message to database and update the conversation
+            try:
+                await message_journal.append(message_schemas.Messages(
                     sender=user_id,
                     recipient=recipient,
                     content=data.get("message")
-                ).insert()
-                
-                user_in_db = await user_schemas.Users.find_one(
-                    user_schemas.Users.id == PydanticObjectId(user_id)
-                )
-                await user_in_db.update(Push({user_schemas.Users.chats: new_message.id}))
-                await user_in_db.save()
+                ))
+            except Exception as e:
+                print(f"Failed to save message from {user_id}: {str(e)}")
+                await connection_manager.send_to_user(user_id, {
+                    "status": "error",
+                    "message": "Message could not be saved, please send it again"
+                })
 
     except (WebSocketDisconnect, json.JSONDecodeError) as e:
         print(f"WebSocket error: {str(e)}")
-        
-        
+    finally:
+        #* Whatever ended the handler, don't leave the connection registered
+        if user_id:
+            await connection_manager.disconnect(user_id, websocket)
+
+
 @app.websocket("/api/v1/chat/g/ws")
 async def chat_to_groups(websocket: WebSocket):
     await websocket.accept()  # *Accept the connection immediately
@@ -267,21 +403,104 @@ async def chat_to_groups(websocket: WebSocket):
     await connection_manager.connect(user_id, websocket)
 
     try:
-        # *Continuously listen for incoming messages
+        # *Keep the connection open until the client leaves
         while True:
-            pass
+            await websocket.receive_text()
+            connection_manager.received()
 
     except WebSocketDisconnect:
-        connection_manager.disconnect(user_id)
+        await connection_manager.disconnect(user_id, websocket)
         
+def document_sources(documents: list) -> list[dict]:
+    '''Returns the distinct source pages of the retrieved `documents`'''
+    sources = []
+    for document in documents:
+        source = {
+            "category": document.metadata.get("category"),
+            "page": document.metadata.get("page"),
+        }
+        if source not in sources:
+            sources.append(source)
+    return sources
+
+
+async def stream_answer(websocket: WebSocket, chain_input: dict) -> tuple[str, list[dict]]:
+    '''Streams the answer for `chain_input` as `sources`, `delta` and `done` JSON frames
+
+    Returns the full answer and its sources.
+    '''
+    answer = []
+    sources = []
+    started = time.perf_counter()
+    async for chunk in chat_bot["rag_chain"].astream(chain_input):
+        if "context" in chunk:
+            sources = document_sources(chunk["context"])
+            await websocket.send_text(encode({"type": "sources", "sources": sources}))
+        if chunk.get("answer"):
+            if not answer:
+                RAG_STAGE_DURATION.observe(time.perf_counter() - started, stage="first_token")
+            answer.append(chunk["answer"])
+            await websocket.send_text(encode({"type": "delta", "content": chunk["answer"]}))
+
+    RAG_STAGE_DURATION.observe(time.perf_counter() - started, stage="answer")
+    await websocket.send_text(encode({"type": "done"}))
+    return "".join(answer), sources
+
+
+async def answer_question(websocket: WebSocket, session: BotSession, question: str, stream: bool):
+    #* Cached answers are context-free, so only the first question of a session may use them
+    cached, vector = None, None
+    if not session.has_history:
+        cached, vector = await semantic_cache.lookup(question)
+
+    if cached is not None:
+        if stream:
+            await websocket.send_text(encode({"type": "sources", "sources": cached["sources"]}))
+            await websocket.send_text(encode({"type": "delta", "content": cached["answer"]}))
+            await websocket.send_text(encode({"type": "done", "cached": True}))
+        else:
+            await websocket.send_text(cached["answer"])
+        session.add_turn(question, cached["answer"])
+        return
+
+    with RAG_STAGE_DURATION.time(stage="prompt_build"):
+        chain_input = session.chain_input(question)
+
+    queued = time.perf_counter()
+    async with bot_limiter.slot(id(websocket)):
+        RAG_STAGE_DURATION.observe(time.perf_counter() - queued, stage="queue")
+        #* Streaming clients get tokens as they are generated
+        if stream:
+            answer, sources = await stream_answer(websocket, chain_input)
+        else:
+            with RAG_STAGE_DURATION.time(stage="answer"):
+                response = await chat_bot["rag_chain"].ainvoke(chain_input)
+            answer, sources = response["answer"], document_sources(response["context"])
+
+    semantic_cache.store(vector, question, answer, sources)
+
+    if not stream:
+        await websocket.send_text(answer)
+
+    session.add_turn(question, answer)
+
+    #* Summarize old turns after the answer is out, keeping the next prompt within budget
+    if session.needs_compaction():
+        async with bot_limiter.slot(id(websocket)):
+            await session.compact()
+
+
 @app.websocket('/api/v1/bot/ws')
-async def chat_to_bot(websocket: WebSocket):
+async def chat_to_bot(websocket: WebSocket, stream: bool = False):
     await websocket.accept()
+    session = BotSession(model)
 
-    while True:
-        data = await websocket.receive_text()
-        response = chat_bot["rag_chain"].invoke({"input": data})
-        await websocket.send_text(response["answer"])
+    try:
+        while True:
+            data = await websocket.receive_text()
+            await answer_question(websocket, session, data, stream)
+    except WebSocketDisconnect:
+        pass
 
 # Include routers
 app.include_router(articles.router)
@@ -290,6 +509,8 @@ app.include_router(users.router)
 app.include_router(posts.router)
 app.include_router(councilor.router)
 app.include_router(auth.router)
+app.include_router(groups.router)
+app.include_router(conversations.router)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", reload=True)
\ No newline at end of file
@@ -0,0 +1,30 @@
+from beanie import PydanticObjectId
+
+from typing import Literal
+from pydantic import Field, BaseModel, ConfigDict, field_serializer
+
+from datetime import datetime
+
+from schemas.conversations import LastMessage
+
+
+class ConversationView(BaseModel):
+    '''Conversation of the current user, with their own unread count instead of every participant's'''
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: PydanticObjectId = Field(..., alias="_id", title="Conversation document ID")
+    conversation_id: str = Field(..., description="direct:<user ID>:<user ID> or group:<group>")
+    kind: Literal["direct", "group"] = Field(..., title="Kind of conversation")
+    participants: list[str] = Field([], title="Participants of a direct conversation")
+    last_message: LastMessage | None = Field(None, title="Last message")
+    message_count: int = Field(0, title="Number of messages")
+    unread: int = Field(0, title="Messages the current user has not read")
+    updated_at: datetime = Field(..., title="Date of the last message")
+
+    @field_serializer("id")
+    def convert_pydantic_object_id_to_string(self, id:PydanticObjectId) -> str:
+        return str(id)
+
+    @field_serializer("updated_at")
+    def convert_updated_at_to_string(self, updated_at: datetime) -> str:
+        return str(updated_at)
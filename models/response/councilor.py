@@ -0,0 +1,19 @@
+from beanie import PydanticObjectId
+
+from pydantic import Field, BaseModel, ConfigDict, field_serializer
+
+
+class CouncilorListing(BaseModel):
+    '''Councilor as listed to users, projected from `Councilor` without their password and permissions'''
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: PydanticObjectId = Field(..., alias="_id", title="Councilor ID")
+    f_name: str = Field(..., title="First Name")
+    l_name: str = Field(..., title="Last Name")
+    email: str = Field(..., title="Email")
+    bio: str = Field("", title="Biography")
+    active: bool = Field(True, title="Active")
+
+    @field_serializer("id")
+    def convert_pydantic_object_id_to_string(self, id:PydanticObjectId) -> str:
+        return str(id)
@@ -0,0 +1,25 @@
+from beanie import PydanticObjectId
+
+from pydantic import Field, BaseModel, ConfigDict, field_serializer
+
+from datetime import datetime
+
+
+class MessageView(BaseModel):
+    '''Read-only message of a chat's history, projected from `Messages`'''
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: PydanticObjectId = Field(..., alias="_id", title="Message ID")
+    content: str = Field(..., title="Content of the message")
+    sender: str = Field(..., title="Sender ID")
+    created: datetime = Field(..., title="Date the message was sent")
+    recipient: str = Field(..., description="Chat ID of the chat the message belongs to")
+    response_to: str | None = Field(None, description="Message ID of the message this message is a response to")
+
+    @field_serializer("id")
+    def convert_pydantic_object_id_to_string(self, id:PydanticObjectId) -> str:
+        return str(id)
+
+    @field_serializer("created")
+    def convert_created_to_string(self, created: datetime) -> str:
+        return str(created)
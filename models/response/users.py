@@ -0,0 +1,29 @@
+from beanie import PydanticObjectId
+
+from pydantic import Field, BaseModel, ConfigDict, field_serializer
+from typing import Literal, Annotated
+
+from schemas.users import Date_Of_Birth
+
+
+class PublicUser(BaseModel):
+    '''Profile of a user as other users see it, projected from `Users`'''
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: PydanticObjectId = Field(..., alias="_id", title="User ID")
+    username: str = Field(..., title="Username")
+    f_name: str = Field(..., title="First Name")
+    l_name: str = Field(..., title="Last Name")
+    addictions: list[Annotated[str, Field(..., title="Addiction ID")]]
+    account_type: Literal["user", "group"] = Field("user", title="Account Type")
+
+    @field_serializer("id")
+    def convert_pydantic_object_id_to_string(self, id:PydanticObjectId) -> str:
+        return str(id)
+
+
+class UserAccount(PublicUser):
+    '''Profile of a user as they see it, without their password and permissions'''
+    email: str = Field(..., title="Email")
+    date_of_birth: Date_Of_Birth = Field(..., title="Date of Birth")
+    active: bool = Field(True, title="Active")
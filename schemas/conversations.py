@@ -0,0 +1,42 @@
+from beanie import Document, PydanticObjectId
+
+from typing import Annotated, Literal
+from pydantic import Field, field_serializer, BaseModel
+from pymongo import IndexModel, ASCENDING, DESCENDING
+
+from datetime import datetime
+
+
+class LastMessage(BaseModel):
+    id: str = Field(..., title="Message ID")
+    sender: str = Field(..., title="Sender ID")
+    content: str = Field(..., title="Start of the message content")
+    created: datetime = Field(..., title="Date the message was sent")
+
+    @field_serializer("created")
+    def convert_created_to_string(self, created: datetime) -> str:
+        return str(created)
+
+
+class Conversations(Document):
+    conversation_id: Annotated[str, Field(max_length=250, description="direct:<user ID>:<user ID> or group:<group>")]
+    kind: Literal["direct", "group"] = Field(..., title="Kind of conversation")
+    participants: list[Annotated[str, Field(..., title="User ID")]] = Field([], title="Participants of a direct conversation, group members are tracked in GroupMembers")
+    last_message: LastMessage | None = Field(None, title="Last message")
+    message_count: int = Field(0, title="Number of messages")
+    unread: dict[str, int] = Field({}, title="Unread messages per participant of a direct conversation")
+    updated_at: datetime = Field(default_factory=datetime.now, title="Date of the last message")
+
+    class Settings:
+        indexes = [
+            IndexModel([("conversation_id", ASCENDING)], unique=True),
+            IndexModel([("participants", ASCENDING), ("updated_at", DESCENDING)]),
+        ]
+
+    @field_serializer("id")
+    def convert_pydantic_object_id_to_string(self, id:PydanticObjectId) -> str:
+        return str(id)
+
+    @field_serializer("updated_at")
+    def convert_updated_at_to_string(self, updated_at: datetime) -> str:
+        return str(updated_at)
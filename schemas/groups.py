@@ -0,0 +1,24 @@
+from beanie import Document, PydanticObjectId
+
+from typing import Annotated
+from pydantic import Field, field_serializer
+from pymongo import IndexModel, ASCENDING
+
+from datetime import datetime
+
+
+class GroupMembers(Document):
+    group: Annotated[str, Field(max_length=100, description="Username of the group account")]
+    user_id: Annotated[str, Field(max_length=100, description="ID of the member")]
+    joined: Annotated[datetime, Field(default_factory=datetime.now)]
+    read_count: Annotated[int, Field(0, description="Number of group messages the member has read")]
+
+    class Settings:
+        indexes = [
+            IndexModel([("group", ASCENDING), ("user_id", ASCENDING)], unique=True),
+            IndexModel([("user_id", ASCENDING)]),
+        ]
+
+    @field_serializer("id")
+    def convert_pydantic_object_id_to_string(self, id:PydanticObjectId) -> str:
+        return str(id)
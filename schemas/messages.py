@@ -2,6 +2,7 @@ from beanie import Document, PydanticObjectId
 
 from typing import Annotated, Literal
 from pydantic import Field, field_serializer
+from pymongo import IndexModel, ASCENDING, DESCENDING
 
 from datetime import datetime
 
@@ -12,7 +13,18 @@ class Messages(Document):
     created: Annotated[datetime, Field(default_factory=datetime.now)]
     recipient: Annotated[str, Field(max_length=100, description="Chat ID of the chat the message belongs to")]
     response_to: Annotated[str | None, Field(max_length=100, description="Message ID of the message this message is a response to")] = None
+
+    class Settings:
+        #* Back the keyset pagination of a chat's history, newest first
+        indexes = [
+            IndexModel([("recipient", ASCENDING), ("created", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("sender", ASCENDING), ("recipient", ASCENDING), ("created", DESCENDING), ("_id", DESCENDING)]),
+        ]
     
     @field_serializer("id")
     def convert_pydantic_object_id_to_string(self, id:PydanticObjectId) -> str:
-        return str(id)
\ No newline at end of file
+        return str(id)
+
+    @field_serializer("created")
+    def convert_created_to_string(self, created: datetime) -> str:
+        return str(created)
\ No newline at end of file
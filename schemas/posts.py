@@ -4,6 +4,7 @@ from beanie import Document, PydanticObjectId
 
 from typing import Annotated, Literal
 from pydantic import Field, field_serializer
+from pymongo import IndexModel, ASCENDING, DESCENDING
 
 class Posts(Document):
     title: str = Field(..., title="Title of the post", max_length=100)
@@ -11,6 +12,13 @@ class Posts(Document):
     creator: str = Field(..., title="Creator of the post")
     created_at: datetime = Field(default_factory=datetime.now, title="Date of creation")
     tags: list[str] = Field([], title="Tags of the post")
+
+    class Settings:
+        #* Feeds are filtered by tag and sorted newest first
+        indexes = [
+            IndexModel([("tags", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("creator", ASCENDING), ("created_at", DESCENDING)]),
+        ]
     
     @field_serializer("id")
     def convert_pydantic_object_id_to_string(self, id:PydanticObjectId) -> str:
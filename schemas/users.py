@@ -4,6 +4,7 @@ from beanie import Document, PydanticObjectId
 
 from typing import Annotated, Literal
 from pydantic import Field, field_serializer, BaseModel
+from pymongo import IndexModel, ASCENDING
 
 class Date_Of_Birth(BaseModel):
     day: int = Field(..., title="Day")
@@ -15,15 +16,19 @@ class Users(Document):
     email: str = Field(..., title="Email")
     f_name: str = Field(..., title="First Name")
     l_name: str = Field(..., title="Last Name")
-    notifications: list[Annotated[PydanticObjectId, Field(..., title="Notification ID")]] = Field([], title="Notifications")
-    posts: list[Annotated[PydanticObjectId, Field(..., title="Post ID")]] = Field([], title="Posts")
     addictions: list[Annotated[str, Field(..., title="Addiction ID")]]
     date_of_birth: Date_Of_Birth = Field(..., title="Date of Birth")
-    chats: list[Annotated[PydanticObjectId, Field(..., title="ID of the user a user is talking to")]] = Field([], title="Chats")
     permissions: list[Annotated[str, Field(..., title="Permission")]]
     password: str = Field(..., title="Password")
     active: bool = Field(True, title="Active")
     account_type: Literal["user", "group"] = Field("user", title="Account Type")
+
+    class Settings:
+        #* Logins look users up by username or email
+        indexes = [
+            IndexModel([("username", ASCENDING)], unique=True),
+            IndexModel([("email", ASCENDING)], unique=True),
+        ]
         
     @field_serializer("id")
     def convert_pydantic_object_id_to_string(self, id:PydanticObjectId) -> str:
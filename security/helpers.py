@@ -1,4 +1,5 @@
-import os, json, re
+import os, json, re, asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 from beanie import PydanticObjectId
@@ -9,6 +10,7 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm, Se
 from jose import JWTError, jwe
 from jose.exceptions import ExpiredSignatureError
 from . models import TokenData
+from . principal_cache import principal_cache
 
 
 from passlib.context import CryptContext
@@ -24,7 +26,23 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 64))
+#* Rehash passwords stored with a different bcrypt cost on successful login
+PASSWORD_REHASH = os.getenv("PASSWORD_REHASH", "true").lower() == "true"
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+#* bcrypt releases the GIL, so hashing in threads uses several cores without blocking the event loop
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+pending_password_hashes = 0
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", scopes={
     "me": "Read information about the current user.",
@@ -34,26 +52,68 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", scopes={
 })
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    '''Verifies that `plain_password` and `hashed_password` are equal'''
-    return pwd_context.verify(plain_password, hashed_password)
+async def run_password_hashing(func, *args):
+    '''Runs `func` in the password hashing pool, rejecting work once too much is queued'''
+    global pending_password_hashes
+    
+    if pending_password_hashes >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again",
+            headers={"Retry-After": "1"},
+        )
+    
+    pending_password_hashes += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_hash_executor, func, *args)
+    finally:
+        pending_password_hashes -= 1
+
+
+async def averify_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    '''Verifies `plain_password` against `hashed_password` off the event loop
+
+    Returns whether they match and, if the hash uses outdated parameters, a new hash of the password.
+    '''
+    return await run_password_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+
 
+async def aget_password_hash(password: str) -> str:
+    '''Returns a hash of the `password`, computed off the event loop'''
+    return await run_password_hashing(pwd_context.hash, password)
+
+COUNCILOR_RANK = 2
 
-def get_password_hash(password: str) -> str:
-    '''Returns a hash of the `password`'''
-    return pwd_context.hash(password)
 
 async def get_user(username: str) -> Users | Councilor | None:
+    '''Returns the user or councilor whose username or email is `username`
+
+    Both collections are searched in a single aggregation using the username
+    and email indexes. A user matching by username wins over one matching by
+    email, which wins over a councilor.
+    '''
+    pipeline = [
+        {"$match": {"$or": [{"username": username}, {"email": username}]}},
+        {"$addFields": {"_rank": {"$cond": [{"$eq": ["$username", {"$literal": username}]}, 0, 1]}}},
+        {"$unionWith": {
+            "coll": Councilor.get_motor_collection().name,
+            "pipeline": [
+                {"$match": {"email": username}},
+                {"$limit": 1},
+                {"$addFields": {"_rank": COUNCILOR_RANK}},
+            ],
+        }},
+        {"$sort": {"_rank": 1}},
+        {"$limit": 1},
+    ]
+    results = await Users.get_motor_collection().aggregate(pipeline).to_list(length=1)
     
-    user_in_db = await Users.find_one(Users.username == username)
+    if not results:
+        return None
     
-    if user_in_db is None:
-        user_in_db = await Users.find_one(Users.email == username)
-        
-    if user_in_db is None:
-        user_in_db = await Councilor.find_one(Councilor.email == username)
-        
-    return user_in_db
+    user_in_db = results[0]
+    model = Councilor if user_in_db.pop("_rank") == COUNCILOR_RANK else Users
+    return model.model_validate(user_in_db)
 
 
 async def authenticate_user(username: str, password: str):
@@ -61,8 +121,12 @@ async def authenticate_user(username: str, password: str):
     
     if not user:
         return False
-    if not verify_password(password, user.password):
+    
+    valid, new_hash = await averify_password(password, user.password)
+    if not valid:
         return False
+    if new_hash and PASSWORD_REHASH:
+        await user.set({"password": new_hash})
     return user
 
 
@@ -87,18 +151,8 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwe
 
 
-async def get_current_user(security_scopes: SecurityScopes, token: Annotated[str, Depends(oauth2_scheme)]):
-    
-    if security_scopes.scopes:
-        authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'
-    else:
-        authenticate_value = "Bearer"
-        
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": authenticate_value},
-    )
+async def resolve_token(token: str, credentials_exception: HTTPException) -> tuple[Users | Councilor, list[str]]:
+    '''Decrypts `token`, loads its user and caches both'''
     try:
         #* Decrypt the JWE token
         token_bytes = token.encode('utf-8')
@@ -131,8 +185,31 @@ async def get_current_user(security_scopes: SecurityScopes, token: Annotated[str
     if user is None:
         raise credentials_exception
     
+    principal_cache.put(token, user, token_data.scopes, exp)
+    return user, token_data.scopes
+
+
+async def get_current_user(security_scopes: SecurityScopes, token: Annotated[str, Depends(oauth2_scheme)]):
+    
+    if security_scopes.scopes:
+        authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'
+    else:
+        authenticate_value = "Bearer"
+        
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": authenticate_value},
+    )
+    #* Tokens seen recently skip decryption and the user lookup
+    cached = principal_cache.get(token)
+    if cached is not None:
+        user, token_scopes = cached
+    else:
+        user, token_scopes = await resolve_token(token, credentials_exception)
+    
     for scope in security_scopes.scopes:
-        if scope not in token_data.scopes:
+        if scope not in token_scopes:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Not enough permissions",
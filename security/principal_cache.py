@@ -0,0 +1,100 @@
+"""Contains the in-process cache of authenticated principals"""
+
+import os, json, time, hashlib
+from collections import OrderedDict
+
+from utils.broker import Broker
+
+
+PRINCIPAL_CACHE_MAX_AGE = float(os.getenv("PRINCIPAL_CACHE_MAX_AGE", 60))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 10_000))
+
+
+class PrincipalCache:
+    '''Caches the user and scopes of decrypted access tokens
+
+    Entries are keyed by a digest of the token, so raw tokens are never kept,
+    and expire at the token's `exp` or after `max_age` seconds, whichever
+    comes first. Call `user_changed` when a user is deactivated or their
+    permissions change, which also tells the other server processes through
+    the broker.
+    '''
+
+    CHANNEL = "principals:changed"
+
+    def __init__(self, max_age: float = PRINCIPAL_CACHE_MAX_AGE, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, object, list[str]]] = OrderedDict()
+        self._tokens_by_user: dict[str, set[str]] = {}
+        self.broker: Broker | None = None
+
+    async def attach(self, broker: Broker):
+        '''Follows user changes made by other server processes'''
+        self.broker = broker
+        await broker.subscribe(self.CHANNEL, self._receive_change)
+
+    async def _receive_change(self, message: str):
+        change = json.loads(message)
+        if change["origin"] != self.broker.node_id:
+            self.invalidate_user(change["user_id"])
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> tuple[object, list[str]] | None:
+        '''Returns the cached (user, scopes) of `token`, if any'''
+        key = self._digest(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, user, scopes = entry
+        if time.time() >= expires:
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return user, scopes
+
+    def put(self, token: str, user, scopes: list[str], exp: float):
+        key = self._digest(token)
+        self._remove(key)
+        self._entries[key] = (min(exp, time.time() + self.max_age), user, scopes)
+        self._tokens_by_user.setdefault(str(user.id), set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = str(entry[1].id)
+        keys = self._tokens_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tokens_by_user[user_id]
+
+    def invalidate_user(self, user_id: str):
+        '''Drops every cached token of `user_id`'''
+        for key in list(self._tokens_by_user.get(str(user_id), ())):
+            self._remove(key)
+
+    async def user_changed(self, user_id: str):
+        '''Drops the cached tokens of `user_id` here and on the other server processes'''
+        self.invalidate_user(user_id)
+        if self.broker is not None:
+            await self.broker.publish(
+                self.CHANNEL,
+                json.dumps({"origin": self.broker.node_id, "user_id": str(user_id)}),
+            )
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+
+principal_cache = PrincipalCache()
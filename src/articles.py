@@ -6,13 +6,14 @@ from beanie import PydanticObjectId
 from beanie.operators import And
 
 from fastapi import APIRouter, Security, status, HTTPException, Query
-from fastapi.responses import JSONResponse
 
 from typing import Annotated, Literal
 from pydantic import ValidationError, Field
 
 from schemas.articles import Articles
 
+from utils.responses import JSONResponse
+
 router = APIRouter(
     prefix='/api/v1/articles',
     tags=['Articles']
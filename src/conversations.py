@@ -0,0 +1,101 @@
+from fastapi import APIRouter, Security, status, HTTPException, Query
+
+from typing import Annotated
+
+from beanie.operators import In, Or
+
+from models.response.conversations import ConversationView
+
+from schemas.conversations import Conversations
+from schemas.groups import GroupMembers
+from schemas.users import Users
+
+from security.helpers import get_current_active_user
+
+from utils.responses import JSONResponse, models_json
+
+
+router = APIRouter(
+    prefix='/api/v1/conversations',
+    tags=['Conversations']
+)
+
+MAX_PAGE_SIZE = 50
+
+
+@router.get("")
+async def get_conversations(current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])],
+                            limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = 20):
+    #* Most recently active conversations of the current user, with their unread counts
+    user_id = str(current_user.id)
+    memberships = await GroupMembers.find(GroupMembers.user_id == user_id).to_list()
+    read_counts = {f"group:{membership.group}": membership.read_count for membership in memberships}
+
+    conversations = await Conversations.find(
+        Or(
+            Conversations.participants == user_id,
+            In(Conversations.conversation_id, list(read_counts)),
+        )
+    ).sort(-Conversations.updated_at).limit(limit).to_list()
+
+    data = []
+    for conversation in conversations:
+        if conversation.kind == "group":
+            unread = conversation.message_count - read_counts.get(conversation.conversation_id, 0)
+        else:
+            unread = conversation.unread.get(user_id, 0)
+        data.append(ConversationView(
+            id=conversation.id,
+            conversation_id=conversation.conversation_id,
+            kind=conversation.kind,
+            participants=conversation.participants,
+            last_message=conversation.last_message,
+            message_count=conversation.message_count,
+            unread=max(unread, 0),
+            updated_at=conversation.updated_at,
+        ))
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "status": "success",
+            "data": models_json(data)
+        }
+    )
+
+
+@router.post("/{conversation_id}/read")
+async def mark_conversation_read(conversation_id: str, current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])]):
+    user_id = str(current_user.id)
+    conversation = await Conversations.find_one(Conversations.conversation_id == conversation_id)
+
+    if conversation is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found"
+        )
+
+    if conversation.kind == "group":
+        group = conversation_id.removeprefix("group:")
+        result = await GroupMembers.find(
+            GroupMembers.group == group,
+            GroupMembers.user_id == user_id,
+        ).update({"$set": {"read_count": conversation.message_count}})
+        found = result.matched_count > 0
+    else:
+        found = user_id in conversation.participants
+        if found:
+            await conversation.update({"$set": {f"unread.{user_id}": 0}})
+
+    if not found:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found"
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "message": "Conversation marked as read"
+        }
+    )
@@ -1,22 +1,26 @@
 from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 
 from datetime import datetime
 
 from beanie import PydanticObjectId
 from beanie.operators import And
 
-from fastapi import APIRouter, Security, status, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Security, status, HTTPException, Query, Header, Response
 
 from typing import Annotated, Literal
 from pydantic import ValidationError, Field
 
 from models.request.councilor import NewCouncilor
+from models.response.councilor import CouncilorListing
 from schemas.councilor import Councilor
 
 from schemas.users import Users
 
-from security.helpers import get_password_hash, get_current_active_user
+from security.helpers import aget_password_hash, get_current_active_user
+
+from utils.councilor_directory import councilor_directory, etag_matches
+from utils.responses import JSONResponse, model_json
 
 router = APIRouter(
     prefix='/api/v1/councilor',
@@ -30,36 +34,37 @@ async def create_councilor(request: NewCouncilor):
         f_name=request.f_name,
         l_name=request.l_name,
         email=request.email,
-        notifications=[],
-        g_chats=[],
         bio="",
         permissions=["councilor", "me"],
-        password=get_password_hash(request.password)
+        password=await aget_password_hash(request.password)
     )
     
-    response = await new_councilor.save()
+    try:
+        response = await new_councilor.save()
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Email already in use"
+        )
+    await councilor_directory.changed()
     
     return JSONResponse(
         status_code=status.HTTP_201_CREATED,
         content={
             "message": "Councilor created successfully",
-            "data": response.model_dump(exclude=["password", "permissions"])
+            "data": model_json(CouncilorListing.model_validate(response, from_attributes=True))
         }
     )
     
 
 @router.get("")
-async def get_councilors(current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])]):
-    #* Retrieve all councilors
+async def get_councilors(current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])],
+                         if_none_match: Annotated[str | None, Header()] = None):
+    #* Served from the rendered directory, clients revalidate with its ETag
+    body, etag = await councilor_directory.get()
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
     
-    councilors_in_db = await Councilor.find_all().to_list()
-    councilors = [councilor.model_dump(exclude=["password", "permissions"]) for councilor in councilors_in_db]
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
     
-    return JSONResponse(
-        status_code=status.HTTP_200_OK,
-        content={
-            "status": "success",
-            "data": councilors
-        }
-    )
-    
\ No newline at end of file
+    return Response(content=body, media_type="application/json", headers=headers)
\ No newline at end of file
@@ -0,0 +1,71 @@
+from fastapi import APIRouter, Security, status, HTTPException
+
+from typing import Annotated
+
+from schemas.users import Users
+
+from security.helpers import get_current_active_user
+
+from utils.groups import GROUPS, group_membership
+from utils.responses import JSONResponse
+
+
+router = APIRouter(
+    prefix='/api/v1/groups',
+    tags=['Groups']
+)
+
+
+def validate_group(group: str):
+    if group not in GROUPS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Group not found"
+        )
+
+
+@router.get("/{group}/members")
+async def get_group_members(group: str, current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])]):
+    validate_group(group)
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "status": "success",
+            "data": sorted(group_membership.members_of(group))
+        }
+    )
+
+
+@router.post("/{group}/members")
+async def join_group(group: str, current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])]):
+    validate_group(group)
+
+    joined = await group_membership.join(group, str(current_user.id))
+
+    return JSONResponse(
+        status_code=status.HTTP_201_CREATED if joined else status.HTTP_200_OK,
+        content={
+            "message": "Joined group successfully" if joined else "Already a member of the group"
+        }
+    )
+
+
+@router.delete("/{group}/members")
+async def leave_group(group: str, current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])]):
+    validate_group(group)
+
+    left = await group_membership.leave(group, str(current_user.id))
+
+    if not left:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not a member of the group"
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "message": "Left group successfully"
+        }
+    )
@@ -6,18 +6,23 @@ from beanie import PydanticObjectId
 from beanie.operators import And
 
 from fastapi import APIRouter, Security, status, HTTPException, Query
-from fastapi.responses import JSONResponse
 
 from typing import Annotated, Literal
 from pydantic import ValidationError, Field
+from pymongo import ASCENDING, DESCENDING
 
 from schemas.messages import Messages
 from schemas.users import Users
 from schemas.councilor import Councilor
 from models.request.messages import NewMessage
+from models.response.messages import MessageView
 
 from security.helpers import get_current_active_user
 
+from utils.message_journal import message_journal
+from utils.pagination import encode_cursor, keyset_filter
+from utils.responses import JSONResponse, models_json
+
 
 router = APIRouter(
     prefix='/api/v1/messages',
@@ -25,6 +30,9 @@ router = APIRouter(
 )
 current_date = datetime.now()
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
 @router.post("")
 async def create_message(request: NewMessage):
     
@@ -44,7 +52,8 @@ async def create_message(request: NewMessage):
     )
     
     try:
-        await new_message.insert()
+        #* Through the journal, like websocket messages, so the message's conversation is updated too
+        await message_journal.append(new_message)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid ID")
     except ValidationError:
@@ -52,40 +61,62 @@ async def create_message(request: NewMessage):
     
     
 @router.get("")
-async def get_messages(recipient: str, current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])],sender: str = None):
-    
+async def get_messages(recipient: str, current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])],sender: str = None,
+                       before: str | None = None, after: str | None = None,
+                       limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE):
+    """Get a page of a chat's messages, newest first
+
+    Args:
+        recipient (str): ID of the chat
+        sender (str, optional): Only messages sent by this user, who must be the current user
+        before (str, optional): Cursor of the page's newer neighbour, to load older messages
+        after (str, optional): Cursor of the page's older neighbour, to load newer messages
+        limit (int): Page size
+
+    Returns:
+        JSONResponse: The messages and the cursors of the oldest and newest of them
+    """
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only one of before and after can be given"
+        )
+
     #* Get all messages in a group chat
     if not sender and recipient:
-        messages = await Messages.find_all(
-            Messages.recipient == recipient
-        )
-        
-        return JSONResponse(
-            status_code=status.HTTP_200_OK,
-            content={
-                "status": "success",
-                "data": messages
-            }
-        )
-    
+        filters = [Messages.recipient == recipient]
     #* Get all messages between two users
-    if sender and (PydanticObjectId(sender) == current_user.id) and recipient:    
-        messages = await Messages.find_all(
-            And(
-                Messages.sender == sender,
-                Messages.recipient == recipient
-            )
+    elif sender and (PydanticObjectId(sender) == current_user.id) and recipient:
+        filters = [Messages.sender == sender, Messages.recipient == recipient]
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid request"
         )
-        
-        return JSONResponse(
-            status_code=status.HTTP_200_OK,
-            content={
-                "status": "success",
-                "data": messages
-            }
-        )
-        
-    raise HTTPException(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        detail="Invalid request"
-    )
\ No newline at end of file
+
+    if before or after:
+        filters.append(keyset_filter("created", before or after, before=bool(before)))
+
+    #* Walk the (recipient, created, _id) index from the cursor, one extra document tells if there are more
+    direction = ASCENDING if after else DESCENDING
+    messages = await Messages.find(*filters).sort(
+        [("created", direction), ("_id", direction)]
+    ).limit(limit + 1).project(MessageView).to_list()
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after:
+        messages.reverse()
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "status": "success",
+            "data": models_json(messages),
+            "cursors": {
+                "before": encode_cursor(messages[-1].created, messages[-1].id) if messages else None,
+                "after": encode_cursor(messages[0].created, messages[0].id) if messages else None,
+            },
+            "has_more": has_more
+        }
+    )
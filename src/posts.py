@@ -3,21 +3,25 @@ from bson.errors import InvalidId
 from datetime import datetime
 
 from beanie import PydanticObjectId
-from beanie.operators import Push, In
+from beanie.operators import In
 
 from fastapi import APIRouter, Security, status, HTTPException, Query
-from fastapi.responses import JSONResponse
 
 from typing import Annotated
-
-from schemas.posts import Posts
+from pymongo import DESCENDING
 
 from security.helpers import get_current_active_user
 
 from models.request.posts import NewPost
+from models.request.users import AddictionEnum
+from models.response.users import PublicUser
 from schemas.posts import Posts
 from schemas.users import Users
 
+from utils.feeds import feed_cache
+from utils.pagination import encode_cursor, keyset_filter
+from utils.responses import JSONResponse, model_json
+
 
 router = APIRouter(
     prefix='/api/v1/posts',
@@ -25,10 +29,13 @@ router = APIRouter(
 )
 current_date = datetime.now()
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
 @router.post("")
 async def create_post(request: NewPost, current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])]):
     
-    creator = await Users.find_one(Users.id == PydanticObjectId(request.creator))
+    creator = await Users.find_one(Users.id == PydanticObjectId(request.creator)).project(PublicUser)
     
     if not creator:
         raise HTTPException(
@@ -36,38 +43,67 @@ async def create_post(request: NewPost, current_user: Annotated[Users, Security(
             detail="Creator not found"
         )
         
+    #* Mongo keeps milliseconds, cursors of cached posts must match the stored value
+    now = datetime.now()
     new_post = Posts(
         title=request.title,
         content=request.content,
         creator=request.creator,
+        created_at=now.replace(microsecond=now.microsecond // 1000 * 1000),
         tags=[addiction for addiction in creator.addictions]
     )
     
     await new_post.save()
-    
-    # Add ID of new post to list of creator's posts
-    await creator.update(Push({Users.posts: new_post.id}))
-    await creator.save()
+    await feed_cache.add(new_post)
     
     return JSONResponse(
         status_code=status.HTTP_201_CREATED,
         content={
             "message": "Post created successfully",
-            "data": new_post.model_dump()
+            "data": model_json(new_post)
         }
     )
     
     
 @router.get("")
-async def get_posts(tags: list = []):
-    all_posts = await  Posts.find(
-        In(Posts.tags, tags)
-    ).to_list()
+async def get_posts(tags: Annotated[list[AddictionEnum], Query()] = [], before: str | None = None,
+                    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE):
+    """Get a page of the posts tagged with any of `tags`, newest first
+
+    Args:
+        tags (list[AddictionEnum]): Addictions to get the posts of
+        before (str, optional): Cursor of the previous page, to load older posts
+        limit (int): Page size
+
+    Returns:
+        JSONResponse: The posts and the cursor of the next page
+    """
+    #* Only addictions are accepted, so clients cannot grow the feed cache with arbitrary tags
+    tags = [tag.value for tag in tags]
+    page = await feed_cache.page(tags, before, limit) if tags else ([], False)
+    
+    if page is None:
+        filters = [In(Posts.tags, tags)]
+        if before:
+            filters.append(keyset_filter("created_at", before, before=True))
+        
+        posts = await Posts.find(*filters).sort(
+            [("created_at", DESCENDING), ("_id", DESCENDING)]
+        ).limit(limit + 1).to_list()
+        page = [(post.created_at, str(post.id), model_json(post)) for post in posts[:limit]], len(posts) > limit
+    
+    entries, has_more = page
+    next_cursor = None
+    if has_more:
+        created_at, id, _ = entries[-1]
+        next_cursor = encode_cursor(created_at, id)
     
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content={
             "status": "success",
-            "data": [post.model_dump() for post in all_posts]
+            "data": [body for _, _, body in entries],
+            "cursor": next_cursor,
+            "has_more": has_more
         }
-    )
\ No newline at end of file
+    )
@@ -1,4 +1,5 @@
 from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 
 from datetime import datetime
 
@@ -6,15 +7,17 @@ from beanie import PydanticObjectId
 from beanie.operators import And
 
 from fastapi import APIRouter, Security, status, HTTPException, Query
-from fastapi.responses import JSONResponse
 
 from typing import Annotated, Literal
 from pydantic import ValidationError, Field
 
 from schemas.users import Users
 from models.request.users import NewUser
+from models.response.users import PublicUser, UserAccount
 
-from security.helpers import get_password_hash
+from security.helpers import aget_password_hash, get_current_active_user
+
+from utils.responses import JSONResponse, model_json
 
 
 router = APIRouter(
@@ -43,15 +46,51 @@ async def create_user(request: NewUser) -> JSONResponse:
         date_of_birth=request.date_of_birth.model_dump(),
         addictions=addictions,
         permissions=["user", "me"],
-        password=get_password_hash(request.password),
+        password=await aget_password_hash(request.password),
         account_type=request.account_type
     )
     
-    response = await new_user.save()
+    try:
+        response = await new_user.save()
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Username or email already in use"
+        )
     return JSONResponse(
         content={
             "message": "Account created successfully",
-            "data": response.model_dump(exclude=["permissions", "password"])
+            "data": model_json(UserAccount.model_validate(response, from_attributes=True))
         },
         status_code=status.HTTP_201_CREATED
+    )
+
+
+@router.get("/{user_id}")
+async def get_user_profile(user_id: str, current_user: Annotated[Users, Security(get_current_active_user, scopes=["user"])]):
+    """Get the public profile of a user
+
+    Args:
+        user_id (str): ID of the user
+
+    Returns:
+        JSONResponse: The user's profile, without their email, password and permissions
+    """
+    try:
+        profile = await Users.find_one(Users.id == PydanticObjectId(user_id)).project(PublicUser)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid ID")
+    
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "status": "success",
+            "data": model_json(profile)
+        }
     )
\ No newline at end of file
@@ -0,0 +1,19 @@
+"""
+Choosing an index that can be trained on the vectors at hand
+"""
+from utils.ann_index import IndexConfig, factory_string
+
+
+def test_small_collections_fall_back_from_pq():
+    config = IndexConfig(index_type="ivf-pq")
+    assert factory_string(config, 64, 300) == "IVF7,Flat"
+
+
+def test_pq_codebooks_shrink_with_the_collection():
+    config = IndexConfig(index_type="ivf-pq")
+    assert factory_string(config, 64, 2000) == "IVF51,PQ64x5"
+    assert factory_string(config, 64, 39 * 256) == "IVF256,PQ64"
+
+
+def test_too_few_vectors_use_a_flat_index():
+    assert factory_string(IndexConfig(index_type="ivf-flat"), 64, 20) == "Flat"
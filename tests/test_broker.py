@@ -0,0 +1,89 @@
+"""
+Cross-process delivery through the Redis broker, with two brokers sharing a fake Redis server
+"""
+import asyncio
+
+import fakeredis
+
+from utils.broker import RedisBroker
+from utils.groups import GroupMembershipIndex
+from utils.websocket import Delivery, WebsocketConnectionManager, encode
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.frames: list[str] = []
+
+    async def send_text(self, data: str):
+        self.frames.append(data)
+
+    async def close(self):
+        pass
+
+
+async def wait_for_frames(websocket: FakeWebSocket, count: int, timeout: float = 5):
+    async with asyncio.timeout(timeout):
+        while len(websocket.frames) < count:
+            await asyncio.sleep(0.01)
+
+
+async def start_nodes(count: int, membership: GroupMembershipIndex) -> list[WebsocketConnectionManager]:
+    server = fakeredis.FakeServer()
+    managers = []
+    for _ in range(count):
+        broker = RedisBroker(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        await broker.start()
+        manager = WebsocketConnectionManager(broker, membership=membership)
+        await manager.start(membership.members)
+        managers.append(manager)
+    return managers
+
+
+async def stop_nodes(managers: list[WebsocketConnectionManager]):
+    for manager in managers:
+        for user_id in list(manager.active_connections):
+            await manager.disconnect(user_id)
+        await manager.broker.close()
+
+
+def test_user_message_reaches_other_process():
+    async def scenario():
+        first, second = await start_nodes(2, GroupMembershipIndex())
+        try:
+            alice = FakeWebSocket()
+            await second.connect("alice", alice)
+
+            assert await first.send_to_user("alice", {"message": "hi"}) is Delivery.SENT
+            await wait_for_frames(alice, 1)
+            assert alice.frames == [encode({"message": "hi"})]
+
+            assert await first.send_to_user("bob", {"message": "hi"}) is Delivery.NOT_CONNECTED
+        finally:
+            await stop_nodes([first, second])
+
+    asyncio.run(scenario())
+
+
+def test_group_message_reaches_members_on_every_process():
+    async def scenario():
+        membership = GroupMembershipIndex()
+        membership.members["grass-quitters"] = {"alice", "bob"}
+        first, second = await start_nodes(2, membership)
+        try:
+            alice, bob, carol = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+            await first.connect("alice", alice)
+            await second.connect("bob", bob)
+            await second.connect("carol", carol)
+
+            await first.send_to_group("grass-quitters", {"message": "hello"})
+            await wait_for_frames(alice, 1)
+            await wait_for_frames(bob, 1)
+
+            assert alice.frames == bob.frames == [encode({"message": "hello"})]
+            #* Not a member, and the sender's own process does not deliver twice
+            assert carol.frames == []
+            assert len(alice.frames) == 1
+        finally:
+            await stop_nodes([first, second])
+
+    asyncio.run(scenario())
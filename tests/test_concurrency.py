@@ -0,0 +1,58 @@
+"""
+Fair slot allocation across keys
+"""
+import asyncio
+
+from utils.concurrency import FairLimiter
+
+
+async def hold(limiter: FairLimiter, key: str, order: list[str], release: asyncio.Event):
+    async with limiter.slot(key):
+        order.append(key)
+        await release.wait()
+
+
+def test_slots_are_granted_round_robin_across_keys():
+    async def scenario():
+        limiter = FairLimiter(1)
+        order = []
+        releases = [asyncio.Event() for _ in range(4)]
+        tasks = []
+        for key, release in zip(["a", "a", "a", "b"], releases):
+            tasks.append(asyncio.create_task(hold(limiter, key, order, release)))
+            await asyncio.sleep(0)
+
+        assert limiter.active == 1 and limiter.waiting == 3
+        #* After the first "a", the slot alternates between keys, so the tasks run as 0, 1, 3, 2
+        for task_number in [0, 1, 3, 2]:
+            releases[task_number].set()
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(*tasks)
+        assert order == ["a", "a", "b", "a"]
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        limiter = FairLimiter(1)
+        release = asyncio.Event()
+        order = []
+        first = asyncio.create_task(hold(limiter, "a", order, release))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(hold(limiter, "b", order, release))
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert limiter.waiting == 0
+
+        release.set()
+        await first
+        assert limiter.active == 0
+        assert order == ["a"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,99 @@
+"""
+Serving post feed pages from the feed cache
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from beanie import PydanticObjectId
+
+from utils.feeds import FeedCache
+from utils.pagination import encode_cursor
+
+
+START = datetime(2025, 1, 1)
+
+
+def entry(number: int) -> tuple:
+    '''Post `number`, newer posts have higher numbers'''
+    return START + timedelta(minutes=number), f"{number:024x}", None
+
+
+def cursor(number: int) -> str:
+    created_at, id, _ = entry(number)
+    return encode_cursor(created_at, PydanticObjectId(id))
+
+
+def numbers(page) -> list[int]:
+    entries, has_more = page
+    return [int(id, 16) for _, id, _ in entries], has_more
+
+
+class StoredFeedCache(FeedCache):
+    '''Feed cache loading from a dict of tag -> post numbers instead of Mongo'''
+
+    def __init__(self, posts: dict[str, list[int]], **kwargs):
+        super().__init__(**kwargs)
+        self.posts = posts
+        self.loads = 0
+        #* Loads wait on it when set, to let posts arrive mid-load
+        self.gate: asyncio.Event | None = None
+
+    async def _load(self, tag: str) -> list[tuple]:
+        self.loads += 1
+        entries = sorted((entry(number) for number in self.posts.get(tag, [])), key=lambda e: e[:2], reverse=True)
+        if self.gate is not None:
+            await self.gate.wait()
+        return entries[:self.size]
+
+
+def test_truncated_feed_pages_stop_at_the_cached_window():
+    async def scenario():
+        cache = StoredFeedCache({"alcohol": list(range(1, 11))}, size=3)
+
+        assert numbers(await cache.page(["alcohol"], None, 2)) == ([10, 9], True)
+        #* Post 8 is the oldest cached one, the page after it may be missing posts
+        assert await cache.page(["alcohol"], cursor(9), 2) is None
+        assert await cache.page(["alcohol"], cursor(8), 2) is None
+        assert await cache.page(["alcohol"], cursor(5), 2) is None
+
+    asyncio.run(scenario())
+
+
+def test_complete_feed_pages_past_the_cursor():
+    async def scenario():
+        cache = StoredFeedCache({"alcohol": [1, 2, 3, 4]}, size=10)
+
+        assert numbers(await cache.page(["alcohol"], cursor(4), 2)) == ([3, 2], True)
+        assert numbers(await cache.page(["alcohol"], cursor(2), 2)) == ([1], False)
+
+    asyncio.run(scenario())
+
+
+def test_posts_shared_by_tags_are_listed_once():
+    async def scenario():
+        cache = StoredFeedCache({"alcohol": [1, 2, 3], "tobacco-and-nicotine": [2, 4]}, size=10)
+
+        page = await cache.page(["alcohol", "tobacco-and-nicotine", "alcohol"], None, 10)
+        assert numbers(page) == ([4, 3, 2, 1], False)
+
+    asyncio.run(scenario())
+
+
+def test_load_racing_with_a_new_post_is_not_kept():
+    async def scenario():
+        cache = StoredFeedCache({"alcohol": [1, 2]}, size=10)
+        cache.gate = asyncio.Event()
+
+        loading = asyncio.create_task(cache.page(["alcohol"], None, 10))
+        await asyncio.sleep(0)
+        #* The post is created after the load read the collection, but before it finished
+        cache.posts["alcohol"].append(3)
+        cache._add(["alcohol"], *entry(3))
+        cache.gate.set()
+        await loading
+
+        assert "alcohol" not in cache._feeds
+        assert numbers(await cache.page(["alcohol"], None, 10)) == ([3, 2, 1], False)
+        assert cache.loads == 2
+
+    asyncio.run(scenario())
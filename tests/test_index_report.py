@@ -0,0 +1,33 @@
+"""
+Finding the app's queries for the startup index report
+"""
+from utils.index_report import QUERY_SHAPES, SOURCE_ROOT, find_queries
+
+
+MODELS = ["Messages", "Posts"]
+
+
+def write_source(root, text: str):
+    (root / "src").mkdir()
+    (root / "src" / "routes.py").write_text(text)
+
+
+def test_literal_filters_are_read_from_the_call(tmp_path):
+    write_source(tmp_path, "async def latest():\n    return await Messages.find(Messages.recipient == 'x').to_list()\n")
+    queries, unchecked = find_queries(tmp_path, MODELS)
+    assert queries == [("Messages", "find", {"recipient"}, "src/routes.py:2")]
+    assert unchecked == []
+
+
+def test_runtime_filters_without_a_shape_are_unchecked(tmp_path):
+    write_source(tmp_path, "async def page(filters):\n    return await Posts.find(*filters).to_list()\n")
+    queries, unchecked = find_queries(tmp_path, MODELS)
+    assert queries == []
+    assert unchecked == ["Posts.find at src/routes.py:2"]
+
+
+def test_app_queries_are_all_checked():
+    queries, unchecked = find_queries(SOURCE_ROOT, ["Messages", "Posts", "Users", "Councilor"])
+    assert unchecked == []
+    declared = {location.split(":")[0] for _, _, _, location in queries if location.endswith("(declared)")}
+    assert declared == {key.split(":")[0] for key in QUERY_SHAPES}
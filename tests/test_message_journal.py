@@ -0,0 +1,56 @@
+"""
+Draining the message journal on shutdown
+"""
+import asyncio
+from types import SimpleNamespace
+
+from utils.message_journal import MessageJournal
+
+
+class SlowJournal(MessageJournal):
+    '''Journal whose writes take a while and are recorded instead of sent to Mongo'''
+
+    def __init__(self, write_time: float, **kwargs):
+        super().__init__(**kwargs)
+        self.write_time = write_time
+        self.written: list = []
+
+    async def _write(self, messages):
+        await asyncio.sleep(self.write_time)
+        self.written.extend(messages)
+
+
+def new_message(number: int):
+    return SimpleNamespace(id=None, number=number)
+
+
+def test_close_finishes_the_flush_in_progress():
+    async def scenario():
+        journal = SlowJournal(0.5, batch_size=2, flush_interval=0.01, durability="enqueue")
+        await journal.start()
+        for number in range(5):
+            await journal.append(new_message(number))
+
+        #* Let the background task start writing the first batch
+        await asyncio.sleep(0.05)
+        await journal.close()
+
+        assert [message.number for message in journal.written] == [0, 1, 2, 3, 4]
+        assert journal._buffer == []
+
+    asyncio.run(scenario())
+
+
+def test_close_resolves_waiting_appends():
+    async def scenario():
+        journal = SlowJournal(0.2, batch_size=10, flush_interval=0.01, durability="flush")
+        await journal.start()
+        appends = [asyncio.create_task(journal.append(new_message(number))) for number in range(3)]
+
+        await asyncio.sleep(0.05)
+        await journal.close()
+
+        await asyncio.wait_for(asyncio.gather(*appends), 1)
+        assert len(journal.written) == 3
+
+    asyncio.run(scenario())
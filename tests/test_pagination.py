@@ -0,0 +1,40 @@
+"""
+Keyset pagination cursors and filters
+"""
+from datetime import datetime
+
+import pytest
+from beanie import PydanticObjectId
+from fastapi import HTTPException
+
+from utils.pagination import decode_cursor, encode_cursor, keyset_filter
+
+
+CREATED = datetime(2025, 1, 1, 12, 30)
+ID = PydanticObjectId("65a000000000000000000001")
+
+
+def test_cursor_round_trips():
+    assert decode_cursor(encode_cursor(CREATED, ID)) == (CREATED, ID)
+
+
+def test_filter_before_cursor_breaks_ties_on_id():
+    assert keyset_filter("created", encode_cursor(CREATED, ID), before=True) == {
+        "$or": [
+            {"created": {"$lt": CREATED}},
+            {"created": CREATED, "_id": {"$lt": ID}},
+        ]
+    }
+
+
+def test_filter_after_cursor():
+    query = keyset_filter("created_at", encode_cursor(CREATED, ID), before=False)
+    assert query["$or"][0] == {"created_at": {"$gt": CREATED}}
+    assert query["$or"][1] == {"created_at": CREATED, "_id": {"$gt": ID}}
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "aGVsbG8=", encode_cursor(CREATED, ID)[:-4]])
+def test_invalid_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        keyset_filter("created", cursor, before=True)
+    assert error.value.status_code == 400
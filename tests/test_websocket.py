@@ -0,0 +1,38 @@
+"""
+Delivery outcomes of the websocket connection manager
+"""
+import asyncio
+
+from utils.broker import InMemoryBroker
+from utils.groups import GroupMembershipIndex
+from utils.websocket import Delivery, WebsocketConnectionManager
+
+
+class StalledWebSocket:
+    '''Client that never accepts a frame'''
+
+    async def send_text(self, data: str):
+        await asyncio.Event().wait()
+
+    async def close(self):
+        pass
+
+
+def test_full_queue_is_reported_as_dropped_not_disconnected():
+    async def scenario():
+        manager = WebsocketConnectionManager(InMemoryBroker(), queue_size=1, send_timeout=60,
+                                             slow_consumer_policy="drop", membership=GroupMembershipIndex())
+        await manager.connect("alice", StalledWebSocket())
+        try:
+            #* The writer takes the first message and stalls on it, the second fills the queue
+            assert await manager.send_to_user("alice", {"message": 1}) is Delivery.SENT
+            await asyncio.sleep(0)
+            assert await manager.send_to_user("alice", {"message": 2}) is Delivery.SENT
+            assert await manager.send_to_user("alice", {"message": 3}) is Delivery.DROPPED
+            assert "alice" in manager.active_connections
+
+            assert await manager.send_to_user("bob", {"message": 1}) is Delivery.NOT_CONNECTED
+        finally:
+            await manager.disconnect("alice")
+
+    asyncio.run(scenario())
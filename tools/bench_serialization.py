@@ -0,0 +1,85 @@
+"""
+Benchmark of the JSON response paths on a page of chat messages
+
+Renders the same messages with the stdlib `JSONResponse` over `model_dump`
+dicts, as the routers used to, and with `utils.responses`. Run from the
+project root:
+
+    python -m tools.bench_serialization --messages 10000 --repeat 20
+"""
+import argparse, json, time
+from datetime import datetime, timedelta
+
+from beanie import PydanticObjectId
+from fastapi.responses import JSONResponse as StdlibJSONResponse
+
+from schemas.messages import Messages
+
+from utils.responses import JSONResponse, dumps, models_json
+
+
+def make_messages(count: int) -> list[Messages]:
+    #* `model_construct` skips Beanie's collection check, no database is needed
+    start = datetime(2025, 1, 1)
+    return [
+        Messages.model_construct(
+            id=PydanticObjectId(),
+            content=f"Message {i} " + "x" * 100,
+            sender=str(PydanticObjectId()),
+            recipient="grass-quitters",
+            created=start + timedelta(seconds=i, microseconds=i),
+            response_to=None,
+        )
+        for i in range(count)
+    ]
+
+
+def measure(render, repeat: int) -> tuple[float, bytes]:
+    '''Returns the best time in milliseconds of `repeat` calls of `render` and its output'''
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = render()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10000, help="messages per response")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per path, the best is reported")
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    candidates = {
+        "stdlib json, model_dump": lambda: StdlibJSONResponse(
+            {"status": "success", "data": [message.model_dump() for message in messages]}
+        ).body,
+        "orjson, model_dump": lambda: JSONResponse(
+            {"status": "success", "data": [message.model_dump() for message in messages]}
+        ).body,
+        "orjson, models_json": lambda: JSONResponse(
+            {"status": "success", "data": models_json(messages)}
+        ).body,
+    }
+
+    baseline, expected = None, None
+    print(f"{'path':<28} {'ms':>9} {'speedup':>8}")
+    for name, render in candidates.items():
+        elapsed, body = measure(render, args.repeat)
+        if baseline is None:
+            baseline, expected = elapsed, json.loads(body)
+        elif json.loads(body) != expected:
+            raise SystemExit(f"{name} does not match the stdlib output")
+        print(f"{name:<28} {elapsed:>9.1f} {baseline / elapsed:>7.1f}x")
+
+    #* WebSocket frames are encoded once per message
+    frames = [{"type": "message", "data": message.model_dump()} for message in messages]
+    stdlib_ms, _ = measure(lambda: [json.dumps(frame) for frame in frames], args.repeat)
+    orjson_ms, _ = measure(lambda: [dumps(frame).decode("utf-8") for frame in frames], args.repeat)
+    print(f"{'websocket frames, stdlib':<28} {stdlib_ms:>9.1f} {1:>7.1f}x")
+    print(f"{'websocket frames, orjson':<28} {orjson_ms:>9.1f} {stdlib_ms / orjson_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Offline recall/latency evaluation of the bot's approximate index types
+
+Run from the project root against the persisted knowledge index:
+
+    python -m tools.index_eval --queries 500 --k 4
+"""
+import argparse, time
+
+import faiss
+import numpy as np
+
+from utils import index_store
+from utils.ann_index import IndexConfig, build_index
+
+
+CANDIDATES = [
+    IndexConfig(index_type="flat"),
+    IndexConfig(index_type="ivf-flat", nprobe=1),
+    IndexConfig(index_type="ivf-flat", nprobe=4),
+    IndexConfig(index_type="ivf-flat", nprobe=16),
+    IndexConfig(index_type="hnsw", ef_search=16),
+    IndexConfig(index_type="hnsw", ef_search=64),
+    IndexConfig(index_type="hnsw", ef_search=256),
+    IndexConfig(index_type="ivf-pq", nprobe=4),
+    IndexConfig(index_type="ivf-pq", nprobe=16),
+]
+
+
+def load_vectors(index_dir) -> np.ndarray:
+    '''Returns the vectors of the most recently saved knowledge index'''
+    folders = sorted(
+        (folder for folder in index_dir.iterdir() if (folder / index_store.MANIFEST_FILE).exists()),
+        key=lambda folder: folder.stat().st_mtime,
+    )
+    if not folders:
+        raise SystemExit(f"No saved index found in {index_dir}, start the server once to build it")
+
+    index = faiss.read_index(str(folders[-1] / index_store.INDEX_FILE))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def recall_at_k(found: np.ndarray, expected: np.ndarray) -> float:
+    hits = sum(len(set(row) & set(truth)) for row, truth in zip(found, expected))
+    return hits / expected.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=500, help="number of queries to sample")
+    parser.add_argument("--k", type=int, default=4, help="neighbours retrieved per query")
+    parser.add_argument("--noise", type=float, default=0.05, help="relative noise added to sampled queries")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = load_vectors(index_store.INDEX_DIR)
+    rng = np.random.default_rng(args.seed)
+
+    #* Perturbed copies of indexed chunks stand in for real questions
+    sample = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    scale = args.noise * np.linalg.norm(sample, axis=1, keepdims=True) / np.sqrt(vectors.shape[1])
+    queries = (sample + rng.normal(size=sample.shape) * scale).astype(np.float32)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, expected = exact.search(queries, args.k)
+
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+    print(f"{'index':<12}{'nprobe':>8}{'efSearch':>10}{'build s':>10}{'ms/query':>10}{'recall':>8}")
+
+    for config in CANDIDATES:
+        start = time.perf_counter()
+        index = build_index(vectors, config)
+        build_time = time.perf_counter() - start
+
+        #* Time queries one by one, as the bot issues them
+        start = time.perf_counter()
+        found = np.vstack([index.search(query[None, :], args.k)[1] for query in queries])
+        latency = (time.perf_counter() - start) / len(queries) * 1000
+
+        print(
+            f"{config.index_type:<12}{config.nprobe:>8}{config.ef_search:>10}"
+            f"{build_time:>10.2f}{latency:>10.3f}{recall_at_k(found, expected):>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Builds the Conversations collection from existing messages and removes the old embedded ID lists
+
+Users.chats, Users.posts, Users.notifications, Councilor.g_chats and
+Councilor.notifications are no longer used. Run once from the project root
+with the server stopped; running it again recomputes the conversations:
+
+    python -m tools.migrate_conversations [--keep-lists]
+"""
+import os, argparse, asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from beanie import init_beanie
+from pymongo import UpdateOne
+
+from schemas.conversations import Conversations
+from schemas.councilor import Councilor
+from schemas.groups import GroupMembers
+from schemas.messages import Messages
+from schemas.users import Users
+
+from utils.conversations import LAST_MESSAGE_LENGTH
+from utils.groups import GROUPS
+
+
+def conversations_pipeline() -> list[dict]:
+    '''Aggregates messages into one summary per conversation, see `utils.conversations.conversation_id`'''
+    is_group = {"$in": ["$recipient", GROUPS]}
+    return [
+        {"$sort": {"created": 1}},
+        {"$addFields": {
+            "conversation_id": {"$cond": [
+                is_group,
+                {"$concat": ["group:", "$recipient"]},
+                {"$cond": [
+                    {"$lt": ["$sender", "$recipient"]},
+                    {"$concat": ["direct:", "$sender", ":", "$recipient"]},
+                    {"$concat": ["direct:", "$recipient", ":", "$sender"]},
+                ]},
+            ]},
+            "is_group": is_group,
+        }},
+        {"$group": {
+            "_id": "$conversation_id",
+            "is_group": {"$first": "$is_group"},
+            "message_count": {"$sum": 1},
+            "last_id": {"$last": "$_id"},
+            "last_sender": {"$last": "$sender"},
+            "last_recipient": {"$last": "$recipient"},
+            "last_content": {"$last": "$content"},
+            "last_created": {"$last": "$created"},
+        }},
+    ]
+
+
+async def migrate(keep_lists: bool):
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    await init_beanie(
+        database=client["Aider"],
+        document_models=[Conversations, Councilor, GroupMembers, Messages, Users],
+    )
+
+    operations = []
+    async for summary in Messages.get_motor_collection().aggregate(conversations_pipeline(), allowDiskUse=True):
+        operations.append(
+            UpdateOne(
+                {"conversation_id": summary["_id"]},
+                {"$set": {
+                    "kind": "group" if summary["is_group"] else "direct",
+                    "participants": [] if summary["is_group"] else sorted([summary["last_sender"], summary["last_recipient"]]),
+                    "last_message": {
+                        "id": str(summary["last_id"]),
+                        "sender": summary["last_sender"],
+                        "content": (summary["last_content"] or "")[:LAST_MESSAGE_LENGTH],
+                        "created": summary["last_created"],
+                    },
+                    "message_count": summary["message_count"],
+                    "unread": {},
+                    "updated_at": summary["last_created"],
+                }},
+                upsert=True,
+            )
+        )
+
+    for start in range(0, len(operations), 1000):
+        await Conversations.get_motor_collection().bulk_write(operations[start:start + 1000], ordered=False)
+    print(f"Wrote {len(operations)} conversations")
+
+    #* Existing group members have read the history they were part of
+    for group in GROUPS:
+        conversation = await Conversations.find_one(Conversations.conversation_id == f"group:{group}")
+        if conversation is not None:
+            await GroupMembers.find(GroupMembers.group == group).update(
+                {"$set": {"read_count": conversation.message_count}}
+            )
+
+    if not keep_lists:
+        users = await Users.get_motor_collection().update_many(
+            {}, {"$unset": {"chats": "", "posts": "", "notifications": ""}}
+        )
+        councilors = await Councilor.get_motor_collection().update_many(
+            {}, {"$unset": {"g_chats": "", "notifications": ""}}
+        )
+        print(f"Removed embedded lists from {users.modified_count} users and {councilors.modified_count} councilors")
+
+    client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keep-lists", action="store_true", help="do not remove the old embedded ID lists")
+    args = parser.parse_args()
+
+    asyncio.run(migrate(args.keep_lists))
+
+
+if __name__ == "__main__":
+    main()
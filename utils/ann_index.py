@@ -0,0 +1,121 @@
+"""
+Contains all code for building approximate nearest neighbour indexes for the bot
+"""
+import os, math
+from typing import Literal
+
+import faiss
+import numpy as np
+
+from pydantic import BaseModel, Field
+
+from langchain_community.vectorstores import FAISS
+
+
+#* PQ codes of 8 bits need 39 * 256 training vectors, below 4 bits the codebooks are too coarse to be useful
+PQ_MAX_NBITS = 8
+PQ_MIN_NBITS = 4
+
+
+class IndexConfig(BaseModel):
+    index_type: Literal["flat", "ivf-flat", "hnsw", "ivf-pq"] = Field("flat", title="Index type")
+    nlist: int = Field(0, title="Number of IVF lists, 0 picks one from the number of vectors")
+    hnsw_m: int = Field(32, title="Neighbours per HNSW node")
+    pq_m: int = Field(0, title="Number of PQ sub-quantizers, 0 picks one from the dimension")
+    nprobe: int = Field(8, title="IVF lists visited per query")
+    ef_search: int = Field(64, title="HNSW search queue size")
+
+    @classmethod
+    def from_env(cls) -> "IndexConfig":
+        return cls(
+            index_type=os.getenv("BOT_INDEX_TYPE", "flat"),
+            nlist=int(os.getenv("BOT_INDEX_NLIST", 0)),
+            hnsw_m=int(os.getenv("BOT_INDEX_HNSW_M", 32)),
+            pq_m=int(os.getenv("BOT_INDEX_PQ_M", 0)),
+            nprobe=int(os.getenv("BOT_INDEX_NPROBE", 8)),
+            ef_search=int(os.getenv("BOT_INDEX_EF_SEARCH", 64)),
+        )
+
+    @property
+    def name(self) -> str:
+        '''Short name identifying the index build parameters'''
+        return f"{self.index_type}-{self.nlist}-{self.hnsw_m}-{self.pq_m}"
+
+
+def factory_string(config: IndexConfig, dimension: int, count: int) -> str:
+    '''Returns the FAISS index factory string for `config`
+
+    Falls back to a flat index when there are too few vectors to train on,
+    and from IVF-PQ to IVF-Flat when there are too few to train PQ codebooks.
+    '''
+    if config.index_type == "flat":
+        return "Flat"
+    if config.index_type == "hnsw":
+        return f"HNSW{config.hnsw_m}"
+
+    #* FAISS wants about 39 training points per IVF list
+    nlist = config.nlist or int(4 * math.sqrt(count))
+    nlist = min(nlist, count // 39)
+    if nlist < 1:
+        print(f"Too few vectors ({count}) to train {config.index_type}, using a flat index")
+        return "Flat"
+
+    if config.index_type == "ivf-flat":
+        return f"IVF{nlist},Flat"
+
+    #* Each sub-quantizer trains 2^nbits centroids on about 39 points each, so smaller
+    #* collections get smaller codebooks, and the sub-quantizer count must divide the dimension
+    pq_m = config.pq_m or next(m for m in (64, 48, 32, 24, 16, 12, 8, 4, 2, 1) if dimension % m == 0)
+    nbits = min(PQ_MAX_NBITS, int(math.log2(max(count // 39, 1))))
+    if nbits < PQ_MIN_NBITS or dimension % pq_m:
+        print(f"Cannot train PQ{pq_m} on {count} vectors of dimension {dimension}, using IVF-Flat")
+        return f"IVF{nlist},Flat"
+    if nbits == PQ_MAX_NBITS:
+        return f"IVF{nlist},PQ{pq_m}"
+    return f"IVF{nlist},PQ{pq_m}x{nbits}"
+
+
+def apply_search_params(index: faiss.Index, config: IndexConfig):
+    '''Sets the query-time parameters (nprobe, efSearch) of `index`'''
+    parameters = faiss.ParameterSpace()
+    if faiss.try_extract_index_ivf(index) is not None:
+        parameters.set_index_parameter(index, "nprobe", config.nprobe)
+    if "HNSW" in type(index).__name__:
+        parameters.set_index_parameter(index, "efSearch", config.ef_search)
+
+
+def build_index(vectors: np.ndarray, config: IndexConfig) -> faiss.Index:
+    '''Builds, trains and fills an index of `vectors` as described by `config`'''
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+
+    index = faiss.index_factory(dimension, factory_string(config, dimension, count))
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+
+    apply_search_params(index, config)
+    return index
+
+
+def serving_store(vector_store: FAISS, config: IndexConfig, index: faiss.Index | None = None) -> FAISS:
+    '''Returns a store sharing the documents of `vector_store` but searching an index built from `config`
+
+    The flat `vector_store` stays the source of truth for incremental updates,
+    the approximate index is derived from its vectors without re-embedding.
+    A prebuilt `index` is used as is.
+    '''
+    if config.index_type == "flat" or vector_store.index.ntotal == 0:
+        return vector_store
+
+    if index is None:
+        index = build_index(vector_store.index.reconstruct_n(0, vector_store.index.ntotal), config)
+    else:
+        apply_search_params(index, config)
+
+    return FAISS(
+        embedding_function=vector_store.embedding_function,
+        index=index,
+        docstore=vector_store.docstore,
+        index_to_docstore_id=dict(vector_store.index_to_docstore_id),
+    )
@@ -0,0 +1,100 @@
+"""
+Contains all code for micro-batching bot retrieval across concurrent queries
+"""
+import os, asyncio
+
+import faiss
+import numpy as np
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import RunnableLambda
+from langchain_community.vectorstores import FAISS
+
+from utils.rag_metrics import RAG_STAGE_DURATION
+
+
+RETRIEVER_K = int(os.getenv("BOT_RETRIEVER_K", 4))
+RETRIEVER_MAX_BATCH = int(os.getenv("BOT_RETRIEVER_MAX_BATCH", 32))
+RETRIEVER_MAX_WAIT = float(os.getenv("BOT_RETRIEVER_MAX_WAIT_MS", 2)) / 1000
+
+
+class BatchRetriever:
+    '''Retrieves documents for concurrent queries in batches
+
+    Queries arriving within `max_wait` seconds of each other, or while a
+    previous batch is being searched, are embedded with one `embed_documents`
+    call and searched with one `index.search` over the stacked query matrix.
+    Each waiting coroutine then gets its own results.
+    '''
+
+    def __init__(self, vector_store: FAISS, embeddings: Embeddings | None = None, k: int = RETRIEVER_K,
+                 max_batch: int = RETRIEVER_MAX_BATCH, max_wait: float = RETRIEVER_MAX_WAIT):
+        self.vector_store = vector_store
+        #* Queries may bypass the store's embedding cache, which is meant for chunks
+        self.embeddings = embeddings or vector_store.embedding_function
+        self.k = k
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._task: asyncio.Task | None = None
+
+    def search(self, queries: list[str]) -> list[list[Document]]:
+        '''Returns the `k` nearest documents of each query'''
+        store = self.vector_store
+        if store.index.ntotal == 0:
+            return [[] for _ in queries]
+
+        with RAG_STAGE_DURATION.time(stage="query_embedding"):
+            vectors = np.asarray(self.embeddings.embed_documents(queries), dtype=np.float32)
+        if store._normalize_L2:
+            faiss.normalize_L2(vectors)
+
+        with RAG_STAGE_DURATION.time(stage="index_search"):
+            _, indices = store.index.search(vectors, min(self.k, store.index.ntotal))
+
+        return [
+            [store.docstore.search(store.index_to_docstore_id[i]) for i in row if i != -1]
+            for row in indices
+        ]
+
+    async def aretrieve(self, query: str) -> list[Document]:
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending.append((query, waiter))
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+        #* Includes the time spent waiting for the batch
+        with RAG_STAGE_DURATION.time(stage="retrieval"):
+            return await waiter
+
+    async def _run(self):
+        #* Give concurrent queries a moment to join the first batch
+        await asyncio.sleep(self.max_wait)
+
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            self._pending = self._pending[self.max_batch:]
+
+            try:
+                results = await asyncio.to_thread(self.search, [query for query, _ in batch])
+            except Exception as e:
+                for _, waiter in batch:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                continue
+
+            for (_, waiter), documents in zip(batch, results):
+                if not waiter.done():
+                    waiter.set_result(documents)
+
+        self._task = None
+
+    def as_runnable(self) -> RunnableLambda:
+        return RunnableLambda(
+            lambda query: self.search([query])[0],
+            afunc=self.aretrieve,
+            name="retrieve_documents",
+        )
@@ -0,0 +1,99 @@
+"""
+Contains all code for keeping per-connection bot conversation state
+"""
+import os
+from collections import deque
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+
+BOT_HISTORY_TOKEN_BUDGET = int(os.getenv("BOT_HISTORY_TOKEN_BUDGET", 1000))
+BOT_HISTORY_MAX_TURNS = int(os.getenv("BOT_HISTORY_MAX_TURNS", 6))
+
+summary_prompt = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "You maintain a running summary of a conversation between a user and an addiction support assistant. "
+            "Update the summary with the new exchanges. Keep the facts the user shared about themselves, "
+            "their goals and the advice already given. Answer with the summary only, in at most 150 words.",
+        ),
+        ("human", "Current summary:\n{summary}\n\nNew exchanges:\n{transcript}"),
+    ]
+)
+
+
+def estimate_tokens(text: str) -> int:
+    '''Cheap token estimate, about four characters per token'''
+    return len(text) // 4 + 1
+
+
+class BotSession:
+    '''Recent turns and a running summary of one bot conversation
+
+    Recent turns are kept verbatim. Once they exceed `token_budget` or
+    `max_turns`, the oldest turns are folded into the summary by the model,
+    so the prompt size stays bounded however long the conversation runs.
+    '''
+
+    def __init__(self, model: BaseChatModel, token_budget: int = BOT_HISTORY_TOKEN_BUDGET,
+                 max_turns: int = BOT_HISTORY_MAX_TURNS):
+        self.model = model
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.turns: deque[tuple[str, str]] = deque()
+        self.summary = ""
+
+    @property
+    def has_history(self) -> bool:
+        return bool(self.turns or self.summary)
+
+    def _tokens(self) -> int:
+        return estimate_tokens(self.summary) + sum(
+            estimate_tokens(question) + estimate_tokens(answer) for question, answer in self.turns
+        )
+
+    def chain_input(self, question: str) -> dict:
+        '''Returns the RAG chain input for `question` in the context of this session'''
+        chat_history = []
+        for past_question, past_answer in self.turns:
+            chat_history.extend([HumanMessage(past_question), AIMessage(past_answer)])
+
+        #* Retrieve with the previous question too, so follow-ups like "tell me more" find context
+        retrieval_query = f"{self.turns[-1][0]}\n{question}" if self.turns else question
+
+        return {
+            "input": question,
+            "chat_history": chat_history,
+            "summary": self.summary or "No earlier conversation.",
+            "retrieval_query": retrieval_query,
+        }
+
+    def add_turn(self, question: str, answer: str):
+        self.turns.append((question, answer))
+
+    def needs_compaction(self) -> bool:
+        return len(self.turns) > self.max_turns or self._tokens() > self.token_budget
+
+    async def compact(self):
+        '''Folds the oldest turns into the summary until the history fits the budget'''
+        folded = []
+        while len(self.turns) > 1 and self.needs_compaction():
+            folded.append(self.turns.popleft())
+
+        if not folded:
+            return
+
+        transcript = "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in folded)
+        try:
+            result = await self.model.ainvoke(
+                summary_prompt.format_messages(summary=self.summary or "None yet.", transcript=transcript)
+            )
+        except Exception as e:
+            #* Keep the turns so they can be folded on the next attempt
+            print(f"Failed to summarize bot session: {str(e)}")
+            self.turns.extendleft(reversed(folded))
+            return
+        self.summary = result.content
@@ -0,0 +1,129 @@
+"""
+Contains all code for passing chat messages between server processes
+"""
+import os, uuid, asyncio
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+
+BROKER_URL = os.getenv("BROKER_URL", "")
+
+Handler = Callable[[str], Awaitable[None]]
+
+
+class Broker(ABC):
+    '''Publish/subscribe channels shared by all server processes
+
+    Each process subscribes to the channels of the users connected to it.
+    Messages for users connected elsewhere are published to their channel.
+    '''
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str) -> int:
+        '''Publishes `message` on `channel`, returns how many subscribers received it'''
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: Handler):
+        '''Calls `handler` with each message published on `channel`'''
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str):
+        '''Stops delivering the messages published on `channel`'''
+
+
+class InMemoryBroker(Broker):
+    '''Broker for a single server process'''
+
+    def __init__(self):
+        super().__init__()
+        self._handlers: dict[str, Handler] = {}
+
+    async def publish(self, channel: str, message: str) -> int:
+        handler = self._handlers.get(channel)
+        if handler is None:
+            return 0
+        await handler(message)
+        return 1
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self._handlers[channel] = handler
+
+    async def unsubscribe(self, channel: str):
+        self._handlers.pop(channel, None)
+
+
+class RedisBroker(Broker):
+    '''Broker shared by server processes through Redis pub/sub
+
+    `client` is a `redis.asyncio.Redis` client created with
+    `decode_responses=True`, or any stand-in with the same interface, such as
+    `fakeredis.aioredis.FakeRedis` in tests.
+    '''
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self._pubsub = client.pubsub()
+        self._handlers: dict[str, Handler] = {}
+        self._listener: asyncio.Task | None = None
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBroker":
+        import redis.asyncio as redis
+        return cls(redis.from_url(url, decode_responses=True))
+
+    async def start(self):
+        #* Subscribing to this process's own channel keeps the pub/sub connection open
+        await self._pubsub.subscribe(f"node:{self.node_id}")
+        self._listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        await self._pubsub.aclose()
+        await self.client.aclose()
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                handler = self._handlers.get(message["channel"])
+                if handler is not None:
+                    await handler(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Broker error: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def publish(self, channel: str, message: str) -> int:
+        return await self.client.publish(channel, message)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self._handlers[channel] = handler
+        await self._pubsub.subscribe(channel)
+
+    async def unsubscribe(self, channel: str):
+        self._handlers.pop(channel, None)
+        await self._pubsub.unsubscribe(channel)
+
+
+def create_broker(url: str = BROKER_URL) -> Broker:
+    '''Returns a Redis broker if `url` points at Redis, otherwise an in-process broker'''
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBroker.from_url(url)
+    return InMemoryBroker()
+
+
+broker = create_broker()
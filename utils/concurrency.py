@@ -0,0 +1,74 @@
+"""
+Contains all code for limiting concurrent work on the event loop
+"""
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Hashable
+
+
+class FairLimiter:
+    '''Limits how many tasks run at once and hands out free slots fairly
+
+    Waiting tasks are queued per key (e.g. per connection) and slots are
+    granted round-robin across keys, so one busy key cannot starve the others.
+    '''
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._queues: OrderedDict[Hashable, deque[asyncio.Future]] = OrderedDict()
+
+    @property
+    def waiting(self) -> int:
+        '''Number of tasks waiting for a slot'''
+        return sum(len(queue) for queue in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable):
+        await self._acquire(key)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, key: Hashable):
+        if self.active < self.limit and not self._queues:
+            self.active += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                #* The slot was granted just before the cancellation
+                self._release()
+            else:
+                queue = self._queues.get(key)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._queues[key]
+            raise
+
+    def _release(self):
+        self.active -= 1
+        self._grant()
+
+    def _grant(self):
+        while self.active < self.limit and self._queues:
+            key, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+
+            #* Rotate the key to the back so the next slot goes to another key
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+
+            if waiter.cancelled():
+                continue
+            self.active += 1
+            waiter.set_result(None)
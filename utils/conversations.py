@@ -0,0 +1,83 @@
+"""
+Contains all code for keeping conversation summaries up to date
+"""
+from collections import Counter
+
+from pymongo import UpdateOne
+
+from schemas.conversations import Conversations
+from schemas.groups import GroupMembers
+from schemas.messages import Messages
+
+from utils.groups import GROUPS
+
+
+LAST_MESSAGE_LENGTH = 200
+
+
+def conversation_id(sender: str, recipient: str) -> str:
+    '''Returns the ID of the conversation a message from `sender` to `recipient` belongs to'''
+    if recipient in GROUPS:
+        return f"group:{recipient}"
+    return "direct:" + ":".join(sorted([sender, recipient]))
+
+
+def conversation_updates(messages: list[Messages]) -> list[UpdateOne]:
+    '''Returns the upserts applying `messages` to their conversations, one per conversation'''
+    updates = {}
+    for message in sorted(messages, key=lambda message: message.created):
+        key = conversation_id(message.sender, message.recipient)
+        update = updates.setdefault(key, {"count": 0, "unread": Counter(), "last": None})
+        update["count"] += 1
+        update["last"] = message
+        if message.recipient not in GROUPS:
+            update["unread"][message.recipient] += 1
+
+    operations = []
+    for key, update in updates.items():
+        last = update["last"]
+        is_group = last.recipient in GROUPS
+        operations.append(
+            UpdateOne(
+                {"conversation_id": key},
+                {
+                    "$set": {
+                        "kind": "group" if is_group else "direct",
+                        "participants": [] if is_group else sorted([last.sender, last.recipient]),
+                        "last_message": {
+                            "id": str(last.id),
+                            "sender": last.sender,
+                            "content": (last.content or "")[:LAST_MESSAGE_LENGTH],
+                            "created": last.created,
+                        },
+                        "updated_at": last.created,
+                    },
+                    "$inc": {
+                        "message_count": update["count"],
+                        **{f"unread.{user_id}": count for user_id, count in update["unread"].items()},
+                    },
+                },
+                upsert=True,
+            )
+        )
+    return operations
+
+
+def group_read_updates(messages: list[Messages]) -> list[UpdateOne]:
+    '''Returns the updates marking group messages as read by their senders, one per sender and group'''
+    sent = Counter((message.recipient, message.sender) for message in messages if message.recipient in GROUPS)
+    return [
+        UpdateOne({"group": group, "user_id": sender}, {"$inc": {"read_count": count}})
+        for (group, sender), count in sent.items()
+    ]
+
+
+async def apply_messages(messages: list[Messages]):
+    '''Updates the conversations of `messages`, and the read counts of group senders, with one bulk write each'''
+    operations = conversation_updates(messages)
+    if operations:
+        await Conversations.get_motor_collection().bulk_write(operations, ordered=False)
+
+    read_operations = group_read_updates(messages)
+    if read_operations:
+        await GroupMembers.get_motor_collection().bulk_write(read_operations, ordered=False)
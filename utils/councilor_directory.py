@@ -0,0 +1,121 @@
+"""
+Contains all code for serving the councilor directory from memory
+"""
+import os, time, asyncio, hashlib
+
+from schemas.councilor import Councilor
+from models.response.councilor import CouncilorListing
+
+from utils.broker import Broker
+from utils.responses import dumps, models_json
+
+
+COUNCILOR_DIRECTORY_TTL = float(os.getenv("COUNCILOR_DIRECTORY_TTL", 600))
+#* Also follow writes made outside the app, needs a replica set
+COUNCILOR_CHANGE_STREAM = os.getenv("COUNCILOR_CHANGE_STREAM", "false").lower() == "true"
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    '''Returns whether an If-None-Match header matches `etag`, weakly as HTTP requires for GET'''
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class CouncilorDirectory:
+    '''The rendered body of the councilor listing and its ETag
+
+    The body is built on first use and rebuilt after a change to the
+    councilors. Changes made by this app call `changed`, which also tells the
+    other server processes through the broker. With `change_stream`, writes
+    made elsewhere are picked up from a Mongo change stream, otherwise the
+    body is rebuilt after `ttl` seconds.
+    '''
+
+    CHANNEL = "councilors:changed"
+
+    def __init__(self, ttl: float = COUNCILOR_DIRECTORY_TTL, change_stream: bool = COUNCILOR_CHANGE_STREAM):
+        self.ttl = ttl
+        self.change_stream = change_stream
+        self.broker: Broker | None = None
+
+        self._body: bytes | None = None
+        self._etag: str | None = None
+        self._loaded = 0.0
+        #* Bumped on every change so a rebuild racing with a change is not kept
+        self._version = 0
+        self._lock = asyncio.Lock()
+        self._watcher: asyncio.Task | None = None
+
+    async def attach(self, broker: Broker):
+        '''Follows councilor changes made by other server processes'''
+        self.broker = broker
+        await broker.subscribe(self.CHANNEL, self._receive_change)
+
+    async def _receive_change(self, message: str):
+        if message != self.broker.node_id:
+            self.invalidate()
+
+    async def start(self):
+        if self.change_stream:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _watch(self):
+        try:
+            async with Councilor.get_motor_collection().watch() as stream:
+                async for _ in stream:
+                    self.invalidate()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Councilor change stream stopped, the directory is refreshed every {self.ttl}s: {str(e)}")
+
+    def invalidate(self):
+        self._body = None
+        self._etag = None
+        self._version += 1
+
+    async def changed(self):
+        '''Drops the rendered directory here and on the other server processes'''
+        self.invalidate()
+        if self.broker is not None:
+            await self.broker.publish(self.CHANNEL, self.broker.node_id)
+
+    @property
+    def _watching(self) -> bool:
+        return self._watcher is not None and not self._watcher.done()
+
+    def _fresh(self) -> bool:
+        #* The change stream reports every write, so no expiry is needed with it
+        return self._body is not None and (self._watching or time.monotonic() - self._loaded < self.ttl)
+
+    async def get(self) -> tuple[bytes, str]:
+        '''Returns the rendered directory and its ETag'''
+        if self._fresh():
+            return self._body, self._etag
+
+        async with self._lock:
+            if self._fresh():
+                return self._body, self._etag
+
+            version = self._version
+            councilors = await Councilor.find_all().project(CouncilorListing).to_list()
+            body = dumps({"status": "success", "data": models_json(councilors)})
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+
+            if version == self._version:
+                self._body, self._etag, self._loaded = body, etag, time.monotonic()
+            return body, etag
+
+
+councilor_directory = CouncilorDirectory()
@@ -0,0 +1,151 @@
+"""
+Contains all code for caching chunk embeddings on disk
+"""
+import os, time, sqlite3, hashlib, threading
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
+from utils.metrics import CACHE_ENTRIES, CACHE_LOOKUPS, registry
+
+
+EMBEDDING_CACHE_PATH = os.getenv("BOT_EMBEDDING_CACHE", "./embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("BOT_EMBEDDING_CACHE_MAX_ENTRIES", 200_000))
+
+#* SQLite limits the number of parameters in a single query
+_LOOKUP_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    '''Collapses whitespace so formatting-only changes hit the same cache entry'''
+    return " ".join(text.split())
+
+
+class CachedEmbeddings(Embeddings):
+    '''Wraps an `Embeddings` model with a persistent, size-bounded embedding cache
+
+    Entries are keyed by the model name and a hash of the normalized text, so
+    only texts that have never been embedded by the model reach it. When the
+    cache grows past `max_entries` the least recently used entries are evicted.
+
+    Only documents are cached: queries are one-off texts that would evict
+    chunk embeddings, so `embed_query` goes straight to the model.
+    '''
+
+    def __init__(self, underlying: Embeddings, model_name: str, path: str = EMBEDDING_CACHE_PATH,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        #* Kept up to date by `_store` and `_evict`, counting rows is a full scan
+        (self._size,) = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+        registry.on_collect(lambda: CACHE_ENTRIES.set(self._size, cache="embedding"))
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+    def _lookup(self, hashes: list[str]) -> dict[str, list[float]]:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(hashes), _LOOKUP_BATCH):
+                batch = hashes[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, *batch],
+                ).fetchall()
+                for text_hash, vector in rows:
+                    found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+                self._db.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, self.model_name, text_hash) for text_hash, _ in rows],
+                )
+            self._db.commit()
+        return found
+
+    def _store(self, entries: dict[str, list[float]]):
+        now = time.time()
+        with self._lock:
+            #* Texts embedded concurrently by another caller are already stored with the same vector
+            changes = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [
+                    (self.model_name, text_hash, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for text_hash, vector in entries.items()
+                ],
+            )
+            self._size += self._db.total_changes - changes
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        excess = self._size - self.max_entries
+        if excess > 0:
+            deleted = self._db.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+            self._size -= deleted.rowcount
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        hashes = [self._hash(text) for text in texts]
+        cached = self._lookup(list(set(hashes)))
+
+        #* Embed each distinct uncached text once
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        CACHE_LOOKUPS.inc(len(texts) - len(missing), cache="embedding", result="hit")
+        CACHE_LOOKUPS.inc(len(missing), cache="embedding", result="miss")
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            cached.update(computed)
+
+        return [cached[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.underlying.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.underlying.aembed_query(text)
+
+    def stats(self) -> dict:
+        '''Returns the cache's hit/miss counters and current size'''
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": self._size,
+            "max_entries": self.max_entries,
+        }
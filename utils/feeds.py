@@ -0,0 +1,169 @@
+"""
+Contains all code for serving per-addiction post feeds from memory
+"""
+import os, time, heapq, asyncio
+from datetime import datetime
+
+import orjson
+from pymongo import DESCENDING
+
+from schemas.posts import Posts
+
+from utils.broker import Broker
+from utils.metrics import CACHE_ENTRIES, CACHE_LOOKUPS, registry
+from utils.pagination import decode_cursor
+from utils.responses import dumps, model_json
+
+
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", 200))
+FEED_CACHE_TTL = float(os.getenv("FEED_CACHE_TTL", 300))
+
+
+class FeedCache:
+    '''Newest posts of each tag, kept in memory with their JSON bodies
+
+    Tags must be addictions (`AddictionEnum` values), which the posts router
+    validates. A tag's feed is loaded from Mongo on first use and refreshed
+    after `ttl` seconds. New posts are added as they are created, on this process and,
+    through the broker, on the others. Pages that reach past the cached window
+    of a tag are not served from the cache.
+    '''
+
+    CHANNEL = "feeds:posts"
+
+    def __init__(self, size: int = FEED_CACHE_SIZE, ttl: float = FEED_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.broker: Broker | None = None
+
+        #* Tag -> {"entries": [(created_at, id, body)] newest first, "complete": all posts cached, "loaded": time}
+        self._feeds: dict[str, dict] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        #* Bumped by every post added to a tag, so a load racing with a new post is not kept
+        self._versions: dict[str, int] = {}
+
+        registry.on_collect(lambda: CACHE_ENTRIES.set(
+            sum(len(feed["entries"]) for feed in self._feeds.values()), cache="feed"
+        ))
+
+    async def attach(self, broker: Broker):
+        '''Follows posts created by other server processes'''
+        self.broker = broker
+        await broker.subscribe(self.CHANNEL, self._receive_post)
+
+    async def _receive_post(self, message: str):
+        post = orjson.loads(message)
+        if post["origin"] != self.broker.node_id:
+            body = orjson.Fragment(orjson.dumps(post["body"]))
+            self._add(post["tags"], datetime.fromisoformat(post["created_at"]), post["id"], body)
+
+    async def add(self, post: Posts):
+        '''Adds a newly created post to the feeds of its tags'''
+        body = model_json(post)
+        self._add(post.tags, post.created_at, str(post.id), body)
+
+        if self.broker is not None:
+            await self.broker.publish(self.CHANNEL, dumps({
+                "origin": self.broker.node_id,
+                "tags": post.tags,
+                "created_at": post.created_at.isoformat(),
+                "id": str(post.id),
+                "body": body,
+            }).decode("utf-8"))
+
+    def _add(self, tags: list[str], created_at: datetime, id: str, body: orjson.Fragment):
+        entry = (created_at, id, body)
+        for tag in tags:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+            feed = self._feeds.get(tag)
+            if feed is None:
+                continue
+
+            entries = feed["entries"]
+            position = 0
+            while position < len(entries) and entries[position][:2] > entry[:2]:
+                position += 1
+            entries.insert(position, entry)
+
+            if len(entries) > self.size:
+                entries.pop()
+                feed["complete"] = False
+
+    async def _load(self, tag: str) -> list[tuple]:
+        '''Returns the entries of the newest `size` posts of `tag`, newest first'''
+        posts = await Posts.find(Posts.tags == tag).sort(
+            [("created_at", DESCENDING), ("_id", DESCENDING)]
+        ).limit(self.size).to_list()
+        return [(post.created_at, str(post.id), model_json(post)) for post in posts]
+
+    async def _feed(self, tag: str) -> dict:
+        feed = self._feeds.get(tag)
+        if feed is not None and time.monotonic() - feed["loaded"] < self.ttl:
+            return feed
+
+        lock = self._locks.setdefault(tag, asyncio.Lock())
+        async with lock:
+            feed = self._feeds.get(tag)
+            if feed is not None and time.monotonic() - feed["loaded"] < self.ttl:
+                return feed
+
+            version = self._versions.get(tag, 0)
+            entries = await self._load(tag)
+
+            feed = {
+                "entries": entries,
+                "complete": len(entries) < self.size,
+                "loaded": time.monotonic(),
+            }
+            if self._versions.get(tag, 0) == version:
+                self._feeds[tag] = feed
+            return feed
+
+    async def page(self, tags: list[str], before: str | None, limit: int) -> tuple[list[tuple], bool] | None:
+        '''Returns up to `limit` entries older than the `before` cursor and whether there are more
+
+        Returns `None` if the page reaches past what the cache holds.
+        '''
+        feeds = [await self._feed(tag) for tag in set(tags)]
+
+        #* Past the oldest cached post of a truncated feed, posts of that tag may be missing
+        boundary = max(
+            (feed["entries"][-1][:2] for feed in feeds if not feed["complete"] and feed["entries"]),
+            default=None,
+        )
+        start = None
+        if before:
+            created_at, id = decode_cursor(before)
+            start = (created_at, str(id))
+
+        page = []
+        seen = set()
+        merged = heapq.merge(*(feed["entries"] for feed in feeds), key=lambda entry: entry[:2], reverse=True)
+        for entry in merged:
+            if start is not None and entry[:2] >= start:
+                continue
+            if entry[1] in seen:
+                continue
+            if boundary is not None and entry[:2] < boundary:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache="feed", result="miss")
+                return None
+            seen.add(entry[1])
+            page.append(entry)
+            if len(page) > limit:
+                break
+        else:
+            #* Ran out of cached posts, they are all older than the boundary only if no feed is truncated
+            if boundary is not None and len(page) <= limit:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache="feed", result="miss")
+                return None
+
+        self.hits += 1
+        CACHE_LOOKUPS.inc(cache="feed", result="hit")
+        return page[:limit], len(page) > limit
+
+
+feed_cache = FeedCache()
@@ -0,0 +1,95 @@
+"""
+Contains all code for tracking group chat membership
+"""
+import json
+
+from pymongo.errors import DuplicateKeyError
+
+from schemas.conversations import Conversations
+from schemas.groups import GroupMembers
+from schemas.messages import Messages
+
+from utils.broker import Broker
+
+
+GROUPS = ["explicit-quitters", "grass-quitters"]
+
+
+class GroupMembershipIndex:
+    '''In-memory index of group -> member IDs, kept in sync with the `GroupMembers` collection
+
+    Joins and leaves are published on the broker so the indexes of other
+    server processes stay in sync too.
+    '''
+
+    CHANNEL = "groups:membership"
+
+    def __init__(self):
+        self.members: dict[str, set[str]] = {group: set() for group in GROUPS}
+        self.broker: Broker | None = None
+
+    async def attach(self, broker: Broker):
+        '''Follows membership changes made by other server processes'''
+        self.broker = broker
+        await broker.subscribe(self.CHANNEL, self._receive_change)
+
+    async def _receive_change(self, message: str):
+        change = json.loads(message)
+        if change["origin"] == self.broker.node_id:
+            return
+        if change["joined"]:
+            self.members.setdefault(change["group"], set()).add(change["user_id"])
+        else:
+            self.members.get(change["group"], set()).discard(change["user_id"])
+
+    async def _publish_change(self, group: str, user_id: str, joined: bool):
+        if self.broker is not None:
+            await self.broker.publish(
+                self.CHANNEL,
+                json.dumps({"origin": self.broker.node_id, "group": group, "user_id": user_id, "joined": joined}),
+            )
+
+    async def load(self):
+        #* Seed memberships from past group messages the first time the collection is used
+        if await GroupMembers.find_all().count() == 0:
+            for group in GROUPS:
+                senders = await Messages.distinct("sender", {"recipient": group})
+                if senders:
+                    await GroupMembers.insert_many([GroupMembers(group=group, user_id=sender) for sender in senders])
+
+        async for membership in GroupMembers.find_all():
+            self.members.setdefault(membership.group, set()).add(membership.user_id)
+
+    def members_of(self, group: str) -> set[str]:
+        return self.members.get(group, set())
+
+    def is_member(self, group: str, user_id: str) -> bool:
+        return user_id in self.members_of(group)
+
+    async def join(self, group: str, user_id: str) -> bool:
+        '''Adds `user_id` to `group`, returns `False` if they already were a member'''
+        if self.is_member(group, user_id):
+            return False
+
+        #* New members start with the group's history read
+        conversation = await Conversations.find_one(Conversations.conversation_id == f"group:{group}")
+        read_count = conversation.message_count if conversation is not None else 0
+        try:
+            await GroupMembers(group=group, user_id=user_id, read_count=read_count).insert()
+        except DuplicateKeyError:
+            pass
+        self.members.setdefault(group, set()).add(user_id)
+        await self._publish_change(group, user_id, True)
+        return True
+
+    async def leave(self, group: str, user_id: str) -> bool:
+        '''Removes `user_id` from `group`, returns `False` if they were not a member'''
+        if not self.is_member(group, user_id):
+            return False
+        await GroupMembers.find(GroupMembers.group == group, GroupMembers.user_id == user_id).delete()
+        self.members[group].discard(user_id)
+        await self._publish_change(group, user_id, False)
+        return True
+
+
+group_membership = GroupMembershipIndex()
@@ -0,0 +1,172 @@
+"""
+Contains all code for checking that the app's Mongo queries are backed by indexes
+"""
+import ast
+from pathlib import Path
+
+from beanie import Document
+
+
+QUERY_METHODS = {"find", "find_one", "find_many", "count", "distinct", "aggregate"}
+FIELD_OPERATORS = {"In", "NotIn", "Eq", "NE", "GT", "GTE", "LT", "LTE", "ElemMatch", "Exists"}
+SOURCE_GLOBS = ["main.py", "src/*.py", "security/*.py", "utils/*.py"]
+#* The app's package directory, so the report does not depend on the working directory
+SOURCE_ROOT = Path(__file__).resolve().parent.parent
+
+#* Shapes of the queries whose filters are built at runtime or are aggregation pipelines, which the
+#* source scan cannot read. Keyed by "<file>:<function>", each shape is (model, fields) and an `Or`
+#* is listed as one shape per alternative. Keep these in step with the queries they describe.
+QUERY_SHAPES: dict[str, list[tuple[str, set[str]]]] = {
+    "src/messages.py:get_messages": [
+        ("Messages", {"recipient"}),
+        ("Messages", {"sender", "recipient"}),
+    ],
+    "src/posts.py:get_posts": [
+        ("Posts", {"tags"}),
+    ],
+    "security/helpers.py:get_user": [
+        ("Users", {"username"}),
+        ("Users", {"email"}),
+        ("Councilor", {"email"}),
+    ],
+}
+
+
+def _name(node: ast.AST) -> str | None:
+    '''Returns the last name of `node`, e.g. `Users` for `user_schemas.Users`'''
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _field(node: ast.AST, model: str) -> str | None:
+    '''Returns the database field of a `Model.field` expression'''
+    if isinstance(node, ast.Attribute) and _name(node.value) == model:
+        return "_id" if node.attr == "id" else node.attr
+    return None
+
+
+def _field_sets(node: ast.AST, model: str) -> list[set[str]]:
+    '''Returns the alternative sets of fields a query condition filters on
+
+    A condition with `Or` needs each alternative backed by an index.
+    '''
+    if isinstance(node, ast.Compare):
+        field = _field(node.left, model)
+        return [{field}] if field else [set()]
+
+    if isinstance(node, ast.Dict):
+        return [{key.value for key in node.keys
+                 if isinstance(key, ast.Constant) and isinstance(key.value, str) and not key.value.startswith("$")}]
+
+    if isinstance(node, ast.Call):
+        operator = _name(node.func)
+        if operator in FIELD_OPERATORS and node.args:
+            field = _field(node.args[0], model)
+            return [{field}] if field else [set()]
+        if operator == "Or":
+            return [fields for arg in node.args for fields in _field_sets(arg, model)]
+        if operator == "And":
+            return _combine([_field_sets(arg, model) for arg in node.args])
+
+    return [set()]
+
+
+def _combine(conditions: list[list[set[str]]]) -> list[set[str]]:
+    '''Returns the field sets of all `conditions` applied together'''
+    combined = [set()]
+    for alternatives in conditions:
+        combined = [fields | alternative for fields in combined for alternative in alternatives]
+    return combined
+
+
+def _query_model(node: ast.AST) -> str | None:
+    '''Returns the model a query is called on, e.g. `Users` for `Users.find` and `Users.get_motor_collection().aggregate`'''
+    if isinstance(node, ast.Call) and _name(node.func) == "get_motor_collection" and isinstance(node.func, ast.Attribute):
+        return _name(node.func.value)
+    return _name(node)
+
+
+class _QueryVisitor(ast.NodeVisitor):
+    '''Collects the query calls of a module with the function each one is made in'''
+
+    def __init__(self, models: list[str]):
+        self.models = models
+        self.function: str | None = None
+        self.calls: list[tuple[ast.Call, str, str | None]] = []
+
+    def _visit_function(self, node):
+        outer, self.function = self.function, node.name
+        self.generic_visit(node)
+        self.function = outer
+
+    visit_FunctionDef = visit_AsyncFunctionDef = _visit_function
+
+    def visit_Call(self, node: ast.Call):
+        if isinstance(node.func, ast.Attribute) and node.func.attr in QUERY_METHODS:
+            model = _query_model(node.func.value)
+            if model in self.models:
+                self.calls.append((node, model, self.function))
+        self.generic_visit(node)
+
+
+def find_queries(root: Path, models: list[str]) -> tuple[list[tuple[str, str, set[str], str]], list[str]]:
+    '''Returns (model, method, fields, location) of each filtered query in the app's source, and the
+    locations of the queries that could not be checked
+
+    Queries whose filters are not written out at the call, such as `find(*filters)` or aggregation
+    pipelines, are checked against their shapes in `QUERY_SHAPES` and are unchecked if they have none.
+    '''
+    queries = []
+    unchecked = []
+    for pattern in SOURCE_GLOBS:
+        for path in sorted(root.glob(pattern)):
+            relative = path.relative_to(root).as_posix()
+            visitor = _QueryVisitor(models)
+            visitor.visit(ast.parse(path.read_text(), filename=str(path)))
+
+            declared = set()
+            for node, model, function in visitor.calls:
+                location = f"{relative}:{node.lineno}"
+                #* The first argument of `distinct` is the key, not a filter
+                filters = node.args[1:] if node.func.attr == "distinct" else node.args
+                conditions = [_field_sets(arg, model) for arg in filters]
+                opaque = node.func.attr == "aggregate" or any(set() in alternatives for alternatives in conditions)
+
+                if not opaque:
+                    for fields in _combine(conditions):
+                        if fields:
+                            queries.append((model, node.func.attr, fields, location))
+                    continue
+
+                key = f"{relative}:{function}"
+                if key not in QUERY_SHAPES:
+                    unchecked.append(f"{model}.{node.func.attr} at {location}")
+                elif key not in declared:
+                    declared.add(key)
+                    for shape_model, fields in QUERY_SHAPES[key]:
+                        queries.append((shape_model, node.func.attr, fields, f"{location} (declared)"))
+    return queries, unchecked
+
+
+async def report_unindexed_queries(document_models: list[type[Document]], root: Path = SOURCE_ROOT) -> list[str]:
+    '''Prints and returns the queries whose filter fields lead no index of their collection, or that could not be checked'''
+    leading_fields = {}
+    for model in document_models:
+        indexes = await model.get_motor_collection().index_information()
+        leading_fields[model.__name__] = {index["key"][0][0] for index in indexes.values()}
+
+    problems = []
+    queries, unchecked = find_queries(root, list(leading_fields))
+    for model, method, fields, location in queries:
+        if not fields & leading_fields.get(model, set()):
+            problems.append(f"{model}.{method}({', '.join(sorted(fields))}) at {location} has no matching index")
+    backed = len(queries) - len(problems)
+    problems.extend(f"{query} could not be checked, add its shape to QUERY_SHAPES" for query in unchecked)
+
+    for problem in problems:
+        print(f"Index report: {problem}")
+    print(f"Index report: {backed} of {len(queries)} query patterns are backed by an index, {len(unchecked)} unchecked")
+    return problems
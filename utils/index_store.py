@@ -0,0 +1,158 @@
+"""
+Contains all code for persisting the bot's FAISS vector index to disk
+"""
+import os, json, time, fcntl, pickle, shutil, hashlib, tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+import faiss
+
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import FAISS
+
+
+INDEX_DIR = Path(os.getenv("BOT_INDEX_DIR", "./index_store"))
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+MANIFEST_FILE = "manifest.json"
+POINTER_SUFFIX = ".current"
+
+
+def file_digest(path: str | Path) -> str:
+    '''Returns the SHA-256 hex digest of the file at `path`'''
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def index_key(sources: list[str | Path], **params) -> str:
+    '''Returns a key identifying an index built from `sources` with `params`
+
+    The key changes whenever the content of a source file, the splitter
+    parameters or the embedding model change.
+    '''
+    digest = hashlib.sha256()
+    for source in sorted(str(s) for s in sources):
+        digest.update(os.path.basename(source).encode("utf-8"))
+        digest.update(file_digest(source).encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def current_folder(key: str) -> Path | None:
+    '''Returns the folder of the current version of the index stored under `key`, if any
+
+    Each save writes a new version folder and then points `<key>.current` at
+    it, so a folder never changes once a reader has found it.
+    '''
+    try:
+        name = (INDEX_DIR / f"{key}{POINTER_SUFFIX}").read_text().strip()
+    except FileNotFoundError:
+        return None
+    folder = INDEX_DIR / name
+    return folder if (folder / MANIFEST_FILE).exists() else None
+
+
+@contextmanager
+def build_lock(key: str):
+    '''Holds the lock on building the index stored under `key`, shared by every process on the host
+
+    Workers starting together wait for the first one to build and save the
+    index instead of each building it.
+    '''
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    #* Dot files are left alone when old versions are removed
+    with open(INDEX_DIR / f".{key}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_manifest(folder: Path) -> dict:
+    '''Returns the manifest saved with the index in `folder`'''
+    with open(folder / MANIFEST_FILE) as f:
+        return json.load(f)
+
+
+def load_index(folder: Path, embeddings: Embeddings) -> FAISS:
+    '''Loads the index saved in `folder`'''
+    #* Memory-map the vectors where the index type supports it
+    try:
+        index = faiss.read_index(str(folder / INDEX_FILE), faiss.IO_FLAG_MMAP)
+    except RuntimeError:
+        index = faiss.read_index(str(folder / INDEX_FILE))
+
+    with open(folder / DOCSTORE_FILE, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+
+def load_derived_index(folder: Path, name: str) -> faiss.Index | None:
+    '''Loads the index `name` derived from the index in `folder`, if any'''
+    path = folder / f"{name}.faiss"
+    if not path.exists():
+        return None
+    return faiss.read_index(str(path))
+
+
+def save_derived_index(folder: Path, name: str, index: faiss.Index):
+    '''Saves an index derived from the index in `folder`
+
+    Derived indexes are removed together with the index they were built from.
+    '''
+    if not folder.exists():
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    os.close(fd)
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, folder / f"{name}.faiss")
+
+
+def save_index(key: str, vector_store: FAISS, manifest: dict | None = None) -> Path:
+    '''Saves `vector_store` as the new version of the index stored under `key` and returns its folder
+
+    The version is written to its own folder, which then becomes current by
+    atomically replacing the `<key>.current` pointer, so concurrent workers
+    never see a partially written index. The previous version is kept for
+    workers still loading it, older versions and other keys are removed.
+    '''
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    previous = current_folder(key)
+    tmp_folder = Path(tempfile.mkdtemp(dir=INDEX_DIR, prefix=f".{key}-"))
+
+    vector_store.save_local(str(tmp_folder))
+    #* The manifest is written last and marks the index as complete
+    with open(tmp_folder / MANIFEST_FILE, "w") as f:
+        json.dump({"key": key, **(manifest or {})}, f)
+
+    folder = INDEX_DIR / f"{key}-{time.time_ns():x}"
+    os.replace(tmp_folder, folder)
+
+    fd, tmp_pointer = tempfile.mkstemp(dir=INDEX_DIR, prefix=".pointer-")
+    with os.fdopen(fd, "w") as f:
+        f.write(folder.name)
+    os.replace(tmp_pointer, INDEX_DIR / f"{key}{POINTER_SUFFIX}")
+
+    keep = {folder.name, f"{key}{POINTER_SUFFIX}"}
+    if previous is not None:
+        keep.add(previous.name)
+    for path in INDEX_DIR.iterdir():
+        if path.name in keep or path.name.startswith("."):
+            continue
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+    return folder
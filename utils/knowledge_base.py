@@ -0,0 +1,219 @@
+"""
+Contains all code for managing the bot's knowledge base of documents
+"""
+import os, threading
+from pathlib import Path
+from typing import Iterator
+
+import faiss
+
+from langchain_core.embeddings import Embeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from models.request.users import AddictionEnum
+from utils import index_store
+from utils.ann_index import IndexConfig, serving_store
+from utils.pdf_ingest import load_pdf_pages
+
+
+KNOWLEDGE_DIR = Path(os.getenv("BOT_KNOWLEDGE_DIR", "./knowledge"))
+#* Chunks embedded at a time while the rest of the document is still being extracted
+EMBED_BATCH_SIZE = int(os.getenv("BOT_EMBED_BATCH_SIZE", 64))
+
+
+def copy_vector_store(vector_store: FAISS) -> FAISS:
+    '''Returns an independent in-memory copy of `vector_store`'''
+    return FAISS(
+        embedding_function=vector_store.embedding_function,
+        index=faiss.clone_index(vector_store.index),
+        docstore=InMemoryDocstore(dict(vector_store.docstore._dict)),
+        index_to_docstore_id=dict(vector_store.index_to_docstore_id),
+    )
+
+
+class KnowledgeBase:
+    '''Keeps a FAISS index in sync with a directory of knowledge documents
+
+    The directory holds one PDF per addiction category, named after the
+    `AddictionEnum` value (e.g. `explicit-content.pdf`). `sync` detects added,
+    changed and removed documents and applies only the delta to a copy of the
+    live index, which then replaces `vector_store` in a single assignment, so
+    readers keep using the old index until the new one is ready.
+    '''
+
+    def __init__(self, embeddings: Embeddings, embedding_model: str, chunk_size: int, chunk_overlap: int,
+                 directory: Path = KNOWLEDGE_DIR, index_config: IndexConfig | None = None):
+        self.embeddings = embeddings
+        self.embedding_model = embedding_model
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.directory = Path(directory)
+        self.index_config = index_config or IndexConfig.from_env()
+
+        #* Flat index updated incrementally, and the (possibly approximate) index queries are served from
+        self.vector_store: FAISS | None = None
+        self.serving_store: FAISS | None = None
+        #* Category -> {"file", "mtime", "size", "sha256", "ids"} of each indexed document
+        self.documents: dict[str, dict] = {}
+        #* Version folder the index was loaded from or saved to
+        self.folder: Path | None = None
+
+        self._lock = threading.Lock()
+        self._splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    @property
+    def key(self) -> str:
+        '''Key of the persisted index, which changes with the splitter or embedding model'''
+        return index_store.index_key(
+            [],
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            extract_images=True,
+            embedding_model=self.embedding_model,
+        )
+
+    @property
+    def serving_name(self) -> str:
+        return f"serving-{self.index_config.name}"
+
+    def load(self):
+        '''Loads the current persisted index, if one was built with the current parameters'''
+        folder = index_store.current_folder(self.key)
+        if folder is None:
+            return
+        loaded = self._load_folder(folder)
+
+        with self._lock:
+            self._apply(folder, *loaded)
+
+    def _load_folder(self, folder: Path) -> tuple[FAISS, FAISS, dict]:
+        manifest = index_store.load_manifest(folder)
+        vector_store = index_store.load_index(folder, self.embeddings)
+        return vector_store, self._serving_store(vector_store, folder), manifest.get("documents", {})
+
+    def _apply(self, folder: Path, vector_store: FAISS, serving: FAISS, documents: dict):
+        self.folder = folder
+        self.vector_store = vector_store
+        self.serving_store = serving
+        self.documents = documents
+
+    def _serving_store(self, vector_store: FAISS, folder: Path) -> FAISS:
+        '''Derives the serving store from `vector_store`, reusing the approximate index persisted in `folder`'''
+        index = index_store.load_derived_index(folder, self.serving_name)
+        store = serving_store(vector_store, self.index_config, index)
+        if index is None and store is not vector_store:
+            index_store.save_derived_index(folder, self.serving_name, store.index)
+        return store
+
+    def scan(self) -> dict[str, Path]:
+        '''Returns the knowledge document of each addiction category present on disk'''
+        files = {}
+        for addiction in AddictionEnum:
+            path = self.directory / f"{addiction.value}.pdf"
+            if path.is_file():
+                files[addiction.value] = path
+        return files
+
+    def _load_document(self, category: str, path: Path, digest: str,
+                       batch_size: int = EMBED_BATCH_SIZE) -> Iterator[tuple[list, list[str]]]:
+        '''Yields batches of chunks of the document at `path` and their IDs
+
+        Pages are split as they come out of the parallel loader, and a batch is
+        yielded as soon as it is full, so it can be embedded while later pages
+        are still being extracted and OCRed.
+        '''
+        splits = []
+        count = 0
+        for page in load_pdf_pages(path):
+            for split in self._splitter.split_documents([page]):
+                split.metadata["category"] = category
+                splits.append(split)
+            if len(splits) >= batch_size:
+                yield splits, [f"{category}:{digest[:12]}:{count + i}" for i in range(len(splits))]
+                count += len(splits)
+                splits = []
+        if splits:
+            yield splits, [f"{category}:{digest[:12]}:{count + i}" for i in range(len(splits))]
+
+    def sync(self) -> dict:
+        '''Applies added, changed and removed documents to the index
+
+        Returns the categories that were added, updated and removed. Syncs are
+        serialized across processes, and a sync starts from the index saved by
+        another process if there is a newer one, so workers starting together
+        build the index once and the others load it.
+        '''
+        with self._lock, index_store.build_lock(self.key):
+            folder = index_store.current_folder(self.key)
+            if folder is not None and folder != self.folder:
+                self._apply(folder, *self._load_folder(folder))
+
+            files = self.scan()
+            documents = {category: dict(entry) for category, entry in self.documents.items()}
+            changed = {}
+
+            for category, path in files.items():
+                stat = path.stat()
+                entry = documents.get(category)
+                if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                    continue
+
+                digest = index_store.file_digest(path)
+                if entry and entry["sha256"] == digest:
+                    #* Touched but not modified
+                    entry.update(mtime=stat.st_mtime, size=stat.st_size)
+                    continue
+
+                changed[category] = {
+                    "file": path.name,
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "sha256": digest,
+                }
+
+            removed = [category for category in documents if category not in files]
+            summary = {
+                "added": [category for category in changed if category not in documents],
+                "updated": [category for category in changed if category in documents],
+                "removed": removed,
+            }
+
+            if not changed and not removed:
+                if documents != self.documents:
+                    self.documents = documents
+                    self.folder = index_store.save_index(self.key, self.vector_store, {"documents": documents})
+                    if self.serving_store is not self.vector_store:
+                        index_store.save_derived_index(self.folder, self.serving_name, self.serving_store.index)
+                return summary
+
+            vector_store = copy_vector_store(self.vector_store) if self.vector_store is not None else None
+
+            stale_ids = [
+                doc_id
+                for category in removed + summary["updated"]
+                for doc_id in documents.pop(category)["ids"]
+            ]
+            if stale_ids:
+                vector_store.delete(stale_ids)
+
+            for category, entry in changed.items():
+                ids = []
+                for batch, batch_ids in self._load_document(category, files[category], entry["sha256"]):
+                    if vector_store is None:
+                        vector_store = FAISS.from_documents(documents=batch, embedding=self.embeddings, ids=batch_ids)
+                    else:
+                        vector_store.add_documents(batch, ids=batch_ids)
+                    ids.extend(batch_ids)
+                print(f"Indexed {len(ids)} chunks of {entry['file']}")
+                documents[category] = {**entry, "ids": ids}
+
+            folder = index_store.save_index(self.key, vector_store, {"documents": documents})
+            serving = self._serving_store(vector_store, folder)
+
+            #* Swap in the new index
+            self._apply(folder, vector_store, serving, documents)
+
+            print(f"Knowledge base synced: {summary}")
+            return summary
@@ -0,0 +1,125 @@
+"""
+Contains all code for persisting chat messages in batches
+"""
+import os, asyncio
+
+from beanie import PydanticObjectId
+from pymongo.errors import BulkWriteError
+
+from schemas.messages import Messages
+
+from utils.conversations import apply_messages
+
+
+MESSAGE_JOURNAL_BATCH_SIZE = int(os.getenv("MESSAGE_JOURNAL_BATCH_SIZE", 100))
+MESSAGE_JOURNAL_FLUSH_INTERVAL = float(os.getenv("MESSAGE_JOURNAL_FLUSH_INTERVAL", 0.2))
+#* "flush": `append` returns once the message is written, "enqueue": once it is buffered
+MESSAGE_JOURNAL_DURABILITY = os.getenv("MESSAGE_JOURNAL_DURABILITY", "flush")
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class MessageJournal:
+    '''Buffers chat messages and writes them to Mongo in batches
+
+    A flush inserts the buffered messages with one `insert_many` and updates
+    their conversations with one `bulk_write`. With the "flush" durability
+    mode messages are written as soon as the previous flush finishes, so
+    concurrent messages share a flush. With "enqueue" the
+    buffer is flushed when it reaches `batch_size` or every `flush_interval`
+    seconds, and failed batches are retried.
+    '''
+
+    def __init__(self, batch_size: int = MESSAGE_JOURNAL_BATCH_SIZE,
+                 flush_interval: float = MESSAGE_JOURNAL_FLUSH_INTERVAL,
+                 durability: str = MESSAGE_JOURNAL_DURABILITY):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+
+        self._buffer: list[tuple[Messages, asyncio.Future | None]] = []
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._flushing = asyncio.Lock()
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        '''Stops the background flushes and writes everything still buffered
+
+        The background task is not cancelled, so a flush in progress finishes
+        writing its batch before the rest of the buffer is flushed.
+        '''
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def append(self, message: Messages) -> Messages:
+        #* Assign the ID up front so it is known before the message is written
+        if message.id is None:
+            message.id = PydanticObjectId()
+
+        written = None
+        if self.durability == "flush":
+            written = asyncio.get_running_loop().create_future()
+
+        self._buffer.append((message, written))
+        if written is not None or len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+        if written is not None:
+            await written
+        return message
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._flushing:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                self._buffer = self._buffer[self.batch_size:]
+
+                try:
+                    await self._write([message for message, _ in batch])
+                except asyncio.CancelledError:
+                    #* Put the batch back, a later flush writes it and resolves its futures
+                    self._buffer[:0] = batch
+                    raise
+                except Exception as e:
+                    print(f"Failed to write {len(batch)} messages: {str(e)}")
+                    for _, written in batch:
+                        if written is not None and not written.done():
+                            written.set_exception(e)
+                    #* Nobody is waiting on buffered-only messages, keep them for the next flush
+                    self._buffer[:0] = [entry for entry in batch if entry[1] is None]
+                    return
+
+                for _, written in batch:
+                    if written is not None and not written.done():
+                        written.set_result(None)
+
+    async def _write(self, messages: list[Messages]):
+        try:
+            await Messages.insert_many(messages, ordered=False)
+        except BulkWriteError as e:
+            #* Messages already written by a previous, partially failed flush
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+
+        await apply_messages(messages)
+
+
+message_journal = MessageJournal()
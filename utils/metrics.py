@@ -0,0 +1,258 @@
+"""
+Contains all code for collecting metrics and exposing them in the Prometheus text format
+
+Metrics are only recorded with METRICS_ENABLED=true, otherwise every update
+returns immediately and the request and Mongo hooks are not installed.
+"""
+import os, time, threading
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+from beanie import Document
+from pymongo import monitoring
+
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Iterable[tuple[str, str]]) -> str:
+    pairs = list(pairs)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+class Registry:
+    '''Holds the metrics of the app and renders them for `/metrics`'''
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self.metrics: list["Metric"] = []
+        self._collectors: list[Callable[[], None]] = []
+
+    def register(self, metric: "Metric"):
+        self.metrics.append(metric)
+
+    def on_collect(self, callback: Callable[[], None]):
+        '''Calls `callback` before each render, to update gauges that are cheaper to read than to track'''
+        if self.enabled:
+            self._collectors.append(callback)
+
+    def render(self) -> str:
+        for callback in self._collectors:
+            callback()
+
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry: Registry = registry):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.enabled = registry.enabled
+
+        self._values: dict[tuple, object] = {}
+        #* Mongo command events arrive on driver threads
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_format_labels(zip(self.labelnames, key))} {float(value)}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class _Timer:
+    def __init__(self, histogram: "Histogram", labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS, registry: Registry = registry):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            #* Per-bucket counts (the last one is +Inf), sum and count
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        '''Returns a context manager observing the time spent in its block'''
+        if not self.enabled:
+            return _NO_TIMER
+        return _Timer(self, labels)
+
+    def _samples(self, key: tuple, value) -> list[str]:
+        counts, total, count = value
+        labels = list(zip(self.labelnames, key))
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip([*self.buckets, "+Inf"], counts):
+            cumulative += bucket_count
+            le = bound if bound == "+Inf" else float(bound)
+            samples.append(f"{self.name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+        samples.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+        samples.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return samples
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["router", "method", "status"])
+HTTP_REQUEST_DURATION = Histogram("http_request_duration_seconds", "HTTP request latency", ["router", "method"])
+
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by outcome", ["cache", "result"])
+CACHE_ENTRIES = Gauge("cache_entries", "Entries held by each cache", ["cache"])
+
+MONGO_COMMANDS = Counter("mongo_commands_total", "Mongo commands", ["model", "command", "outcome"])
+MONGO_COMMAND_DURATION = Histogram("mongo_command_duration_seconds", "Mongo command latency", ["model", "command"])
+
+
+class RequestMetricsMiddleware:
+    '''Records the latency of each HTTP request, labelled with the tag of the router that served it'''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            #* FastAPI puts the matched route in the scope, its first tag names the router
+            route = scope.get("route")
+            tags = getattr(route, "tags", None)
+            router = tags[0] if tags else getattr(route, "path", "unmatched")
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, router=router, method=scope["method"])
+            HTTP_REQUESTS.inc(router=router, method=scope["method"], status=status_code)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    '''Counts and times the commands sent to Mongo, labelled with the Beanie model of their collection'''
+
+    def __init__(self):
+        self.models: dict[str, str] = {}
+        self._collections: dict[tuple, str] = {}
+
+    def register_models(self, document_models: list[type[Document]]):
+        for model in document_models:
+            self.models[model.get_motor_collection().name] = model.__name__
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        else:
+            collection = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event, "success")
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finish(event, "failure")
+
+    def _finish(self, event, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        model = self.models.get(collection, collection or "none")
+        MONGO_COMMANDS.inc(model=model, command=event.command_name, outcome=outcome)
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, model=model, command=event.command_name)
+
+
+mongo_command_listener = MongoCommandListener()
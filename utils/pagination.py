@@ -0,0 +1,38 @@
+"""
+Contains all code for keyset (cursor) pagination
+"""
+import base64
+from datetime import datetime
+
+from beanie import PydanticObjectId
+from bson.errors import InvalidId
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(created: datetime, id: PydanticObjectId) -> str:
+    '''Returns an opaque cursor pointing at the document with sort key (`created`, `id`)'''
+    return base64.urlsafe_b64encode(f"{created.isoformat()}|{id}".encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, PydanticObjectId]:
+    try:
+        created, id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(created), PydanticObjectId(id)
+    except (ValueError, InvalidId, UnicodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def keyset_filter(field: str, cursor: str, before: bool) -> dict:
+    '''Returns a filter matching documents sorted before (or after) `cursor` on (`field`, `_id`)'''
+    created, id = decode_cursor(cursor)
+    operator = "$lt" if before else "$gt"
+    return {
+        "$or": [
+            {field: {operator: created}},
+            {field: created, "_id": {operator: id}},
+        ]
+    }
@@ -0,0 +1,102 @@
+"""
+Contains all code for loading knowledge PDFs in parallel
+"""
+import os, hashlib, tempfile, multiprocessing
+from pathlib import Path
+from typing import Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pypdf import PdfReader
+
+from langchain_core.documents import Document
+
+
+PDF_WORKERS = int(os.getenv("BOT_PDF_WORKERS", os.cpu_count() or 1))
+PAGES_PER_SHARD = int(os.getenv("BOT_PDF_PAGES_PER_SHARD", 4))
+PAGE_CACHE_DIR = Path(os.getenv("BOT_PAGE_CACHE_DIR", "./page_cache"))
+
+#* Created lazily in each worker process, the OCR model is expensive to load
+_ocr = None
+
+
+def _page_digest(page) -> str:
+    '''Returns a hash of the page's content stream and embedded images'''
+    digest = hashlib.sha256()
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    for image in page.images:
+        digest.update(image.data)
+    return digest.hexdigest()
+
+
+def _ocr_images(page) -> str:
+    global _ocr
+    texts = []
+    for image in page.images:
+        if _ocr is None:
+            from rapidocr_onnxruntime import RapidOCR
+            _ocr = RapidOCR()
+        result, _ = _ocr(image.data)
+        if result:
+            texts.extend(text for _, text, _ in result)
+    return "\n".join(texts)
+
+
+def _extract_page(page) -> str:
+    '''Returns the text of `page`, OCRing its images, using the page cache when possible'''
+    cached = PAGE_CACHE_DIR / f"{_page_digest(page)}.txt"
+    if cached.exists():
+        return cached.read_text(encoding="utf-8")
+
+    text = page.extract_text() + "\n" + _ocr_images(page)
+
+    PAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=PAGE_CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, cached)
+    return text
+
+
+def _load_shard(file_path: str, page_numbers: list[int]) -> list[tuple[int, str]]:
+    reader = PdfReader(file_path)
+    return [(number, _extract_page(reader.pages[number])) for number in page_numbers]
+
+
+def load_pdf_pages(file_path: str | Path, workers: int = PDF_WORKERS,
+                   pages_per_shard: int = PAGES_PER_SHARD) -> Iterator[Document]:
+    '''Yields a `Document` per page of the PDF at `file_path`, in page order
+
+    Pages are sharded across a process pool so text extraction and OCR run on
+    all cores. Pages are yielded as soon as every earlier page is done, so the
+    caller can split and embed while later pages are still being processed.
+    '''
+    file_path = str(file_path)
+    page_count = len(PdfReader(file_path).pages)
+    shards = [
+        list(range(start, min(start + pages_per_shard, page_count)))
+        for start in range(0, page_count, pages_per_shard)
+    ]
+
+    def to_document(number: int, text: str) -> Document:
+        return Document(page_content=text, metadata={"source": file_path, "page": number})
+
+    if workers <= 1 or len(shards) <= 1:
+        for shard in shards:
+            for number, text in _load_shard(file_path, shard):
+                yield to_document(number, text)
+        return
+
+    #* Spawn rather than fork, the server process has threads running
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=context) as pool:
+        futures = [pool.submit(_load_shard, file_path, shard) for shard in shards]
+
+        pending = {}
+        next_page = 0
+        for future in as_completed(futures):
+            pending.update(future.result())
+            while next_page in pending:
+                yield to_document(next_page, pending.pop(next_page))
+                next_page += 1
@@ -0,0 +1,49 @@
+"""
+Contains all code for timing the stages of the bot's answers
+"""
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from utils.metrics import Histogram
+
+
+RAG_STAGE_DURATION = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each stage of answering a bot question",
+    ["stage"],
+)
+GENERATION_TOKENS_PER_SECOND = Histogram(
+    "rag_generation_tokens_per_second",
+    "Generation speed of the chat model",
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200),
+)
+GENERATION_TOKENS = Histogram(
+    "rag_generation_tokens",
+    "Tokens per model call",
+    ["kind"],
+    buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192),
+)
+
+
+class GenerationMetricsHandler(AsyncCallbackHandler):
+    '''Records the prompt evaluation and generation timings Ollama reports with each response
+
+    Works for streamed and non-streamed calls, as the final chunk of a stream
+    carries the same timings.
+    '''
+
+    async def on_llm_end(self, response: LLMResult, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or {}
+                #* Ollama reports durations in nanoseconds
+                if info.get("prompt_eval_duration"):
+                    RAG_STAGE_DURATION.observe(info["prompt_eval_duration"] / 1e9, stage="prompt_eval")
+                    GENERATION_TOKENS.observe(info.get("prompt_eval_count", 0), kind="prompt")
+                if info.get("eval_duration"):
+                    RAG_STAGE_DURATION.observe(info["eval_duration"] / 1e9, stage="generation")
+                    GENERATION_TOKENS.observe(info.get("eval_count", 0), kind="completion")
+                    GENERATION_TOKENS_PER_SECOND.observe(info.get("eval_count", 0) / (info["eval_duration"] / 1e9))
+
+
+generation_metrics = GenerationMetricsHandler()
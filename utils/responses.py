@@ -0,0 +1,54 @@
+"""
+Contains all code for rendering JSON responses
+"""
+from functools import lru_cache
+from typing import Any
+
+import orjson
+from pydantic import BaseModel, TypeAdapter
+from fastapi.responses import JSONResponse as StarletteJSONResponse
+
+
+DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: type[BaseModel]) -> TypeAdapter:
+    '''Returns the serializer of lists of `model`, built once per model'''
+    return TypeAdapter(list[model])
+
+
+def model_json(model: BaseModel, exclude: set[str] | None = None) -> orjson.Fragment:
+    '''Serializes `model` to JSON that can be embedded in a response's content'''
+    return orjson.Fragment(model.__pydantic_serializer__.to_json(model, exclude=exclude))
+
+
+def models_json(models: list[BaseModel], exclude: set[str] | None = None) -> orjson.Fragment:
+    '''Serializes `models`, which share a type, in a single pass of their list serializer'''
+    if not models:
+        return orjson.Fragment(b"[]")
+    return orjson.Fragment(
+        list_adapter(type(models[0])).dump_json(models, exclude={"__all__": exclude} if exclude else None)
+    )
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return model_json(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    '''Encodes `content` with orjson, pydantic models in it are serialized with their own serializers'''
+    return orjson.dumps(content, default=_default, option=DUMPS_OPTIONS)
+
+
+class JSONResponse(StarletteJSONResponse):
+    '''`JSONResponse` rendered with orjson
+
+    `content` may hold pydantic models and fragments from `model_json` and
+    `models_json`, which skip the intermediate dicts of `model_dump`.
+    '''
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,115 @@
+"""
+Contains all code for caching bot answers by question similarity
+"""
+import os, time
+from collections import OrderedDict
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
+from utils.metrics import CACHE_ENTRIES, CACHE_LOOKUPS, registry
+
+
+SEMANTIC_CACHE_ENABLED = os.getenv("BOT_SEMANTIC_CACHE", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("BOT_SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_TTL = float(os.getenv("BOT_SEMANTIC_CACHE_TTL", 3600))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("BOT_SEMANTIC_CACHE_MAX_ENTRIES", 1000))
+
+
+class SemanticCache:
+    '''Caches answers and returns them for questions with a similar embedding
+
+    A question hits the cache when the cosine similarity between its embedding
+    and a previously answered question is at least `threshold`. Entries expire
+    after `ttl` seconds and the least recently used entry is evicted once
+    `max_entries` is reached.
+    '''
+
+    def __init__(self, embeddings: Embeddings, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl: float = SEMANTIC_CACHE_TTL, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 enabled: bool = SEMANTIC_CACHE_ENABLED):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._next_key = 0
+        #* Stacked question vectors, rebuilt lazily after the entries change
+        self._keys: list[int] = []
+        self._matrix: np.ndarray | None = None
+
+        registry.on_collect(lambda: CACHE_ENTRIES.set(len(self._entries), cache="semantic"))
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    async def lookup(self, question: str) -> tuple[dict | None, np.ndarray | None]:
+        '''Returns the cached entry answering `question`, if any, and the question's vector
+
+        The vector can be passed to `store` to avoid embedding the question twice.
+        '''
+        if not self.enabled:
+            return None, None
+
+        vector = np.asarray(await self.embeddings.aembed_query(question), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        self._purge_expired()
+        if self._entries:
+            if self._matrix is None:
+                self._keys = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[key]["vector"] for key in self._keys])
+
+            similarities = self._matrix @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                key = self._keys[best]
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc(cache="semantic", result="hit")
+                return self._entries[key], vector
+
+        self.misses += 1
+        CACHE_LOOKUPS.inc(cache="semantic", result="miss")
+        return None, vector
+
+    def store(self, vector: np.ndarray | None, question: str, answer: str, sources: list[dict]):
+        if not self.enabled or vector is None:
+            return
+
+        while len(self._entries) >= self.max_entries:
+            self._entries.popitem(last=False)
+
+        self._entries[self._next_key] = {
+            "question": question,
+            "answer": answer,
+            "sources": sources,
+            "vector": vector,
+            "created": time.monotonic(),
+        }
+        self._next_key += 1
+        self._matrix = None
+
+    def invalidate(self):
+        '''Drops every cached answer, e.g. after the knowledge index changed'''
+        self._entries.clear()
+        self._matrix = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
@@ -1,30 +1,212 @@
 """
 Contains all code for websocket connectivity and management
 """
+import os, enum, asyncio
+from functools import partial
 from fastapi import WebSocket
-from typing import Dict
+from typing import Dict, Iterable
+
+import orjson
+
+from utils.broker import Broker, InMemoryBroker
+from utils.groups import GroupMembershipIndex, group_membership
+from utils.metrics import Counter, Gauge, registry
+from utils.responses import dumps
+
+
+WS_OUTBOUND_QUEUE_SIZE = int(os.getenv("WS_OUTBOUND_QUEUE_SIZE", 100))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", 10))
+#* What to do when a client's outbound queue is full: "drop" the message or "disconnect" the client
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop")
+
+WS_ACTIVE_CONNECTIONS = Gauge("ws_active_connections", "Websocket connections to this process", ["manager"])
+WS_QUEUED_MESSAGES = Gauge("ws_queued_messages", "Messages waiting in outbound queues", ["manager"])
+WS_MAX_QUEUE_DEPTH = Gauge("ws_max_queue_depth", "Fullest outbound queue", ["manager"])
+WS_MESSAGES_RECEIVED = Counter("ws_messages_received_total", "Websocket messages received from clients", ["manager"])
+WS_MESSAGES_SENT = Counter("ws_messages_sent_total", "Websocket messages sent to clients", ["manager"])
+WS_MESSAGES_DROPPED = Counter("ws_messages_dropped_total", "Messages dropped for slow consumers", ["manager"])
+
+
+class Delivery(enum.Enum):
+    '''Outcome of sending a message to a user'''
+    SENT = "sent"
+    #* Connected, but their outbound queue is full
+    DROPPED = "dropped"
+    NOT_CONNECTED = "not-connected"
+
+
+def encode(data: dict) -> str:
+    '''Encodes a frame once with orjson, it is then shared by every recipient and the broker'''
+    return dumps(data).decode("utf-8")
 
 
 # Connection manager for handling WebSocket connections
 class WebsocketConnectionManager:
-    def __init__(self):
+    '''Tracks connected users and delivers messages to them
+
+    Every connection has a bounded outbound queue drained by its own writer
+    task, so sending never waits on a client. A client whose queue is full is
+    handled by the slow consumer policy, and a client that fails or takes
+    longer than `send_timeout` to accept a message is disconnected.
+
+    `active_connections` only holds this process's connections. Users
+    connected to other processes are reached through the `broker`: each user
+    has a `user:<id>` channel and each group a `group:<name>` channel. Group
+    members are resolved by each process from its `membership` index, which
+    the broker keeps in sync.
+    '''
+
+    def __init__(self, broker: Broker | None = None, queue_size: int = WS_OUTBOUND_QUEUE_SIZE,
+                 send_timeout: float = WS_SEND_TIMEOUT, slow_consumer_policy: str = WS_SLOW_CONSUMER_POLICY,
+                 name: str = "chat", membership: GroupMembershipIndex = group_membership):
+        self.name = name
+        self.broker = broker or InMemoryBroker()
+        self.membership = membership
         self.active_connections: Dict[str, WebSocket] = {}
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.slow_consumer_policy = slow_consumer_policy
+        self.dropped_messages = 0
+
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._writers: Dict[str, asyncio.Task] = {}
+        self._closing: set[asyncio.Task] = set()
+
+        registry.on_collect(self._report_metrics)
+
+    def _report_metrics(self):
+        depths = [queue.qsize() for queue in self._queues.values()]
+        WS_ACTIVE_CONNECTIONS.set(len(self.active_connections), manager=self.name)
+        WS_QUEUED_MESSAGES.set(sum(depths), manager=self.name)
+        WS_MAX_QUEUE_DEPTH.set(max(depths, default=0), manager=self.name)
+
+    def received(self):
+        '''Counts a message received from a client'''
+        WS_MESSAGES_RECEIVED.inc(manager=self.name)
+
+    async def start(self, groups: Iterable[str]):
+        '''Subscribes to the channels of `groups`'''
+        for group in groups:
+            await self.broker.subscribe(f"group:{group}", partial(self._receive_group_message, group))
 
     async def connect(self, user_id: str, websocket: WebSocket):
+        #* A user has a single connection, a new one replaces the old one
+        if user_id in self.active_connections:
+            await self.disconnect(user_id)
+
+        queue = asyncio.Queue(maxsize=self.queue_size)
         self.active_connections[user_id] = websocket
-        
+        self._queues[user_id] = queue
+        self._writers[user_id] = asyncio.create_task(self._write(user_id, websocket, queue))
+
+        await self.broker.subscribe(f"user:{user_id}", partial(self._receive_user_message, user_id))
+
         print(f"Active connections: {self.active_connections.keys()}")
 
-    async def disconnect(self, user_id: str):
-        """Disconnect and remove a user's WebSocket connection"""
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].close()
-            del self.active_connections[user_id]
+    async def disconnect(self, user_id: str, websocket: WebSocket | None = None):
+        """Disconnect and remove a user's WebSocket connection
 
-    async def send_to_user(self, user_id: str, data: dict):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_json(data)
+        If `websocket` is given, the user is only disconnected if it is still their current connection.
+        """
+        websocket = websocket or self.active_connections.get(user_id)
+        if self._remove(user_id, websocket):
+            await self._close(user_id, websocket)
+
+    def _remove(self, user_id: str, websocket: WebSocket | None) -> bool:
+        if websocket is None or self.active_connections.get(user_id) is not websocket:
+            return False
+
+        del self.active_connections[user_id]
+        del self._queues[user_id]
+        writer = self._writers.pop(user_id)
+        if writer is not asyncio.current_task():
+            writer.cancel()
+        return True
+
+    async def _close(self, user_id: str, websocket: WebSocket):
+        #* Unless the user reconnected in the meantime
+        if user_id not in self.active_connections:
+            await self.broker.unsubscribe(f"user:{user_id}")
+
+        try:
+            await websocket.close()
+        except Exception:
+            #* Already closed by the client
+            pass
+
+    def _close_later(self, user_id: str, websocket: WebSocket):
+        task = asyncio.create_task(self._close(user_id, websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _write(self, user_id: str, websocket: WebSocket, queue: asyncio.Queue):
+        try:
+            while True:
+                payload = await queue.get()
+                await asyncio.wait_for(websocket.send_text(payload), self.send_timeout)
+                WS_MESSAGES_SENT.inc(manager=self.name)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Disconnecting {user_id}: {str(e) or type(e).__name__}")
+            if self._remove(user_id, websocket):
+                self._close_later(user_id, websocket)
+
+    def _enqueue(self, user_id: str, payload: str) -> Delivery:
+        queue = self._queues.get(user_id)
+        if queue is None:
+            return Delivery.NOT_CONNECTED
+
+        try:
+            queue.put_nowait(payload)
+            return Delivery.SENT
+        except asyncio.QueueFull:
+            self.dropped_messages += 1
+            WS_MESSAGES_DROPPED.inc(manager=self.name)
+            if self.slow_consumer_policy == "disconnect":
+                print(f"Disconnecting slow consumer {user_id}")
+                websocket = self.active_connections[user_id]
+                if self._remove(user_id, websocket):
+                    self._close_later(user_id, websocket)
+            return Delivery.DROPPED
+
+    async def _receive_user_message(self, user_id: str, payload: str):
+        self._enqueue(user_id, payload)
+
+    def _deliver_to_group(self, group: str, payload: str):
+        for member in self.membership.members_of(group) & self._queues.keys():
+            self._enqueue(member, payload)
+
+    async def _receive_group_message(self, group: str, message: str):
+        envelope = orjson.loads(message)
+        if envelope["origin"] != self.broker.node_id:
+            self._deliver_to_group(group, envelope["payload"])
+
+    async def send_to_user(self, user_id: str, data: dict) -> Delivery:
+        '''Delivers `data` to `user_id`, returns whether it was sent, dropped or they are not connected
+
+        A user connected elsewhere is subscribed to their channel there, so the
+        number of subscribers reached by the publish tells if they are connected.
+        Messages dropped by the other process are reported as sent.
+        '''
+        payload = encode(data)
+        if user_id in self._queues:
+            return self._enqueue(user_id, payload)
+        if await self.broker.publish(f"user:{user_id}", payload) > 0:
+            return Delivery.SENT
+        return Delivery.NOT_CONNECTED
+
+    async def send_to_group(self, group: str, data: dict):
+        '''Delivers `data` to the connected members of `group` on every server process'''
+        payload = encode(data)
+        self._deliver_to_group(group, payload)
+
+        #* One publish reaches every other process, each delivers to its own members
+        await self.broker.publish(
+            f"group:{group}",
+            encode({"origin": self.broker.node_id, "payload": payload}),
+        )
 
     async def broadcast(self, data: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(data)
\ No newline at end of file
+        for user_id in list(self._queues):
+            self._enqueue(user_id, data)